@@ -1,19 +1,30 @@
 """FASTAPI SERVER."""
 
 import asyncio
+import base64
+import json
 import sys
-from http import HTTPStatus
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Annotated
 
 import httpx
 import toml
-from aiocache import cached
-from fastapi import FastAPI
+from fastapi import FastAPI, File, Form, HTTPException, Request, Response, UploadFile, WebSocket
+from fastapi import Path as PathParam
+from fastapi.responses import JSONResponse, StreamingResponse
 from loguru import logger
 from pydantic import BaseModel, Field
 from rich.console import Console
 
-from backend.otp_validation import is_valid_otp
+from backend.gateway_cache import DEFAULT_MAX_ENTRIES, build_gateway_cache
+from backend.jobs import DEFAULT_MAX_QUEUED, DEFAULT_MAX_RUNNING, DEFAULT_RESULT_TTL_S, Job, JobQueue, JobQueueFullError
+from backend.model_client import DEFAULT_MAX_CONCURRENCY, DEFAULT_TIMEOUT_S, HTTPModelClient, ModelClient
+from backend.model_server.uploads import write_atomic
+from backend.otp_validation import DEFAULT_HYSTERESIS, DEFAULT_MIN_HOLD, OTP_PATTERN, is_otp_code, is_valid_otp, is_valid_otp_timeline
+from backend.single_flight import SingleFlight
 
 sys.path.append(str(Path(__file__).parent.resolve().parent))
 from unified_logging.config_types import LoggingConfigs
@@ -29,18 +40,66 @@ console = Console()
 config = toml.load("route_config.toml")
 RAY_OTP_SERVICE_URL = config["server"]["RAY_OTP_SERVICE_URL"]
 RAY_OCR_SERVICE_URL = config["server"]["RAY_OCR_SERVICE_URL"]
-app = FastAPI()
+OTP_VERIFY_IN_DEPLOYMENT = config["server"].get("OTP_VERIFY_IN_DEPLOYMENT", False)
+OTP_MIN_HOLD_FRAMES = config["server"].get("OTP_MIN_HOLD_FRAMES", DEFAULT_MIN_HOLD)
+OTP_HYSTERESIS = config["server"].get("OTP_HYSTERESIS", DEFAULT_HYSTERESIS)
+OTP_STREAM_CHUNK_FRAMES = config["server"].get("OTP_STREAM_CHUNK_FRAMES", 5)
+UPSTREAM_TIMEOUT_S = config["server"].get("UPSTREAM_TIMEOUT_S", DEFAULT_TIMEOUT_S)
+UPSTREAM_MAX_CONNECTIONS = config["server"].get("UPSTREAM_MAX_CONNECTIONS", 32)
+UPSTREAM_MAX_KEEPALIVE = config["server"].get("UPSTREAM_MAX_KEEPALIVE", 16)
+OCR_MAX_CONCURRENCY = config["server"].get("OCR_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+OTP_MAX_CONCURRENCY = config["server"].get("OTP_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+GATEWAY_CACHE_BACKEND = config["server"].get("GATEWAY_CACHE_BACKEND", "lru")
+GATEWAY_CACHE_MAX_ENTRIES = config["server"].get("GATEWAY_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+GATEWAY_CACHE_PATH = Path(config["server"].get("GATEWAY_CACHE_PATH", ".model_cache/gateway_results.sqlite"))
+JOB_MAX_RUNNING = config["server"].get("JOB_MAX_RUNNING", DEFAULT_MAX_RUNNING)
+JOB_MAX_QUEUED = config["server"].get("JOB_MAX_QUEUED", DEFAULT_MAX_QUEUED)
+JOB_RESULT_TTL_S = config["server"].get("JOB_RESULT_TTL_S", DEFAULT_RESULT_TTL_S)
+JOB_EVENT_KEEPALIVE_S = 15.0
+UPLOAD_MAX_BYTES = int(config["server"].get("UPLOAD_MAX_MB", 64) * 1024 * 1024)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024  # multipart boundaries and form fields around the uploaded file
+UID_PATTERN = r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$"  # a single folder name under `user_data`, so no `..` or path separators
+user_dir = Path.cwd() / "user_data"
+
+# Replaced with deployment handle clients when the app runs as a Ray Serve ingress (backend/serve_gateway.py)
+model_clients: dict[str, ModelClient] = {
+    "ocr": HTTPModelClient(RAY_OCR_SERVICE_URL, OCR_MAX_CONCURRENCY, UPSTREAM_TIMEOUT_S),
+    "otp": HTTPModelClient(RAY_OTP_SERVICE_URL, OTP_MAX_CONCURRENCY, UPSTREAM_TIMEOUT_S),
+}
+in_flight = SingleFlight()  # coalesces identical concurrent requests, e.g. double-clicked buttons
+result_cache = build_gateway_cache(GATEWAY_CACHE_BACKEND, GATEWAY_CACHE_MAX_ENTRIES, GATEWAY_CACHE_PATH, in_flight)
+background_tasks: set[asyncio.Task] = set()
+jobs = JobQueue(JOB_MAX_RUNNING, JOB_MAX_QUEUED, JOB_RESULT_TTL_S)
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    """Share one keep-alive connection pool to the Ray Serve proxy for the lifetime of the app."""
+    limits = httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS, max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE)
+    async with httpx.AsyncClient(limits=limits, timeout=UPSTREAM_TIMEOUT_S) as client:
+        for model_client in model_clients.values():
+            if isinstance(model_client, HTTPModelClient):
+                model_client.bind(client)
+        yield
+        await jobs.close()
+        for model_client in model_clients.values():
+            if isinstance(model_client, HTTPModelClient):
+                model_client.bind(None)
+    logger.info(f"Upstream request coalescing: {in_flight.stats()}, result cache: {result_cache.stats()}, jobs: {jobs.stats()}")
+    result_cache.close()
+
+app = FastAPI(lifespan=lifespan)
 
 class OCRRequest(BaseModel):
     """Schema for OCR validation request."""
 
-    uid: str = Field(..., min_length=1, max_length=255, description="Path to the user file.")
+    uid: str = Field(..., min_length=1, max_length=255, pattern=UID_PATTERN, description="User folder name.")
 
 class OTPRequest(BaseModel):
     """Schema for OTP validation request."""
 
-    otp: str = Field(..., min_length=1, max_length=4, description="OTP should be exactly 4 digits.")
-    uid: str = Field(..., min_length=1, max_length=255, description="Path to the user file.")
+    otp: str = Field(..., min_length=4, max_length=4, pattern=OTP_PATTERN, description="OTP should be exactly 4 digits.")
+    uid: str = Field(..., min_length=1, max_length=255, pattern=UID_PATTERN, description="User folder name.")
 
 class FaceValid(BaseModel):
     """Schema for face similarity validation."""
@@ -49,37 +108,296 @@ class FaceValid(BaseModel):
     ref_path:Path = Field(..., min_length=1, max_length=255, description="Path to the user reference file.")
 
 @app.post("/validate-otp")
-@cached(ttl=60)
 async def validate_otp(request: OTPRequest) -> dict[str, bool]:
     """Validate OTP by processing the video file asynchronously."""
     logger.info(f"Received OTP validation request for UID: {request.uid}")
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        response = await client.post(RAY_OTP_SERVICE_URL, json=request.model_dump())
-        generated_otp=[]
-        if response.status_code == HTTPStatus.OK:
-            console.print(response.json())
-            generated_otp = response.json().get("otp")
-            logger.info(f"OTP response received successfully for UID: {request.uid}")
-    console.print(generated_otp)
-    is_valid = await asyncio.to_thread(is_valid_otp, generated_otp, list(request.otp))
+    video_path = user_dir / request.uid / "recorded_videos" / "live_recording.mp4"
+    return await result_cache.fetch("otp", request.uid, video_path, request.otp, lambda: otp_verdict(request))
+
+async def otp_verdict(request: OTPRequest, uploads: dict[str, bytes] | None = None) -> tuple[dict[str, bool], bool]:
+    """Ask the video deployment for the OTP verdict; the flag is False if the upstream call failed."""
+    payload = request.model_dump()
+    if OTP_VERIFY_IN_DEPLOYMENT:
+        payload["mode"] = "verify"
+    result = await model_clients["otp"].request(payload, uploads=uploads)
+    succeeded = "error" not in result
+    if not succeeded:
+        logger.error(f"OTP request failed for UID {request.uid}: {result['error']}")
+        result = {}
+    else:
+        logger.info(f"OTP response received successfully for UID: {request.uid}")
+    segments = result.get("segments")
+    verified = result.get("verified")
+    console.print(
+        f"[cyan]OTP response:[/cyan] {len(segments) if segments is not None else len(result.get('otp') or [])} "
+        f"{'segments' if segments is not None else 'frames'}, {result.get('frames_inferred')}/{result.get('frames_total')} frames inferred, "
+        f"{result.get('buffer_allocations')} frame buffers allocated, timings {result.get('timings_ms')}, verified={verified}",
+    )
+    if verified is None and segments is not None:
+        is_valid = await asyncio.to_thread(is_valid_otp_timeline, segments, list(request.otp), min_hold=OTP_MIN_HOLD_FRAMES, hysteresis=OTP_HYSTERESIS)
+    elif verified is None:
+        generated_otp = result.get("otp") or []
+        is_valid = await asyncio.to_thread(is_valid_otp, generated_otp, list(request.otp), min_hold=OTP_MIN_HOLD_FRAMES, hysteresis=OTP_HYSTERESIS)
+    else:
+        is_valid = verified
     logger.info(f"OTP validation result for UID {request.uid}: {is_valid}")
-    return {"valid": is_valid}
+    return {"valid": is_valid}, succeeded
+
+@app.websocket("/ws/validate-otp/{uid}")
+async def stream_validate_otp(websocket: WebSocket, uid: Annotated[str, PathParam(min_length=1, max_length=255, pattern=UID_PATTERN)]) -> None:
+    """Validate OTP on frames streamed while recording.
+
+    The client sends `{"otp": ..., "expected_frames": ...}`, then one binary message per JPEG encoded frame,
+    then `{"event": "end"}`. Frames are forwarded in numbered chunks to a streaming session of the video deployment,
+    and `{"valid": ...}` is sent back once the recording ends or the verdict is already decided.
+    """
+    await websocket.accept()
+    start = await websocket.receive_json()
+    otp = str(start.get("otp", ""))
+    if not is_otp_code(otp):
+        await websocket.close(code=1008, reason="OTP should be exactly 4 digits")
+        return
+    logger.info(f"Received OTP stream for UID: {uid}")
+    session = {"mode": "stream", "uid": uid, "otp": otp, "expected_frames": int(start.get("expected_frames", 0))}
+    stream = OTPStream(session, await reference_upload(uid))
+    frames: list[str] = []
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            logger.warning(f"OTP stream closed by the client for UID: {uid}")
+            return
+        final = message.get("bytes") is None
+        if not final:
+            frames.append(base64.b64encode(message["bytes"]).decode())
+            if len(frames) < OTP_STREAM_CHUNK_FRAMES:
+                continue
+        result = await stream.send(frames, final=final)
+        frames = []
+        if final or "error" in result:
+            break
+        if result.get("status") != "pending":  # decided early, close the session right away
+            result = await stream.send([], final=True)
+            break
+    if "error" in result:
+        logger.error(f"OTP stream forwarding failed for UID {uid}: {result['error']}")
+    console.print(
+        f"[cyan]OTP stream:[/cyan] {result.get('frames_inferred')}/{result.get('frames_total')} frames inferred, "
+        f"timings {result.get('timings_ms')}, verified={result.get('verified')}",
+    )
+    is_valid = bool(result.get("verified", False))
+    logger.info(f"OTP stream validation result for UID {uid}: {is_valid}")
+    await websocket.send_json({"valid": is_valid})
+    await websocket.close()
+
+class OTPStream:
+    """Forwards the chunks of one recording to a streaming session of the video deployment.
+
+    Chunks are numbered, and the frames sent so far are kept. If the deployment reports the session lost (the chunk
+    reached a replica without it, or the session was evicted), the recording is replayed into a new session.
+    The first chunk of a session carries `uploads` (the user's reference face), so the replica needs no shared `user_data`.
+    """
+
+    def __init__(self, session: dict, uploads: dict[str, bytes] | None = None) -> None:
+        """Start a new session with the fields sent along with every chunk and the uploads sent with its first chunk."""
+        self.session = session
+        self.uploads = uploads
+        self.session_id = uuid.uuid4().hex
+        self.seq = 0
+        self.sent: list[str] = []
+
+    async def send(self, frames: list[str], *, final: bool) -> dict:
+        """Send the next chunk, replaying the whole recording once if the session was lost."""
+        result = await self._send_chunk(frames, final=final)
+        if result.get("session_lost"):
+            logger.warning(f"OTP stream session lost for UID {self.session['uid']}, replaying {len(self.sent) + len(frames)} frames: {result['error']}")
+            self.session_id, self.seq, frames, self.sent = uuid.uuid4().hex, 0, [*self.sent, *frames], []
+            result = await self._send_chunk(frames, final=final)
+        return result
+
+    async def _send_chunk(self, frames: list[str], *, final: bool) -> dict:
+        uploads = self.uploads if self.seq == 0 else None
+        result = await model_clients["otp"].request({**self.session, "seq": self.seq, "frames": frames, "final": final}, self.session_id, uploads)
+        if "error" not in result:
+            self.seq += 1
+            self.sent.extend(frames)
+        return result
+
+async def reference_upload(uid: str) -> dict[str, bytes]:
+    """Read the user's extracted ID face to send along as the `reference` upload, if it exists."""
+    reference_path = user_dir / uid / "Extracted_ID_Face.jpg"
+    try:
+        return {"reference": await asyncio.to_thread(reference_path.read_bytes)}
+    except FileNotFoundError:
+        return {}
+
+async def warm_reference_face(uid: str) -> None:
+    """Ask the video deployment to cache the user's freshly extracted reference face."""
+    uploads = await reference_upload(uid)
+    result = await in_flight.do(("warm", uid), lambda: model_clients["otp"].request({"uid": uid, "mode": "warm"}, uploads=uploads))
+    if "error" in result:
+        logger.warning(f"Reference face warm-up failed for UID {uid}: {result['error']}")
 
 @app.post("/ocr-content")
-@cached(ttl=60)
 async def ocr_content(request: OCRRequest) -> dict:
     """Validate OCR by processing the document file asynchronously."""
     logger.info(f"Received OCR request for UID: {request.uid}")
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        response = await client.post(RAY_OCR_SERVICE_URL, json=request.model_dump())
-        generated_ocr=""
-        valid=False
-        if response.status_code == HTTPStatus.OK:
-            console.print(response.json())
-            generated_ocr = response.json().get("ocr_text")
-            valid=True
-            logger.info(f"OCR response received successfully for UID: {request.uid}")
-    return {"text": generated_ocr, "valid":valid}
+    id_proof_path = user_dir / request.uid / "id_proof.jpg"
+    return await result_cache.fetch("ocr", request.uid, id_proof_path, "", lambda: ocr_verdict(request))
+
+async def ocr_verdict(request: OCRRequest, image: bytes | None = None) -> tuple[dict, bool]:
+    """Ask the OCR deployment for the ID card text; the flag is False if the upstream call failed."""
+    result = await model_clients["ocr"].request(request.model_dump(), uploads=None if image is None else {"image": image})
+    # Artifacts of uploaded images, written here since the replica may not share the gateway's `user_data` folder:
+    # the face for the user's video verification, which sends it along with the recording, and the card for the frontend
+    artifacts = {"reference_face_b64": "Extracted_ID_Face.jpg", "processed_card_b64": "Processed_ID_Card_Best_angle.jpg"}
+    for field, name in artifacts.items():
+        encoded = result.pop(field, None) if isinstance(result, dict) else None
+        if encoded is not None:
+            await asyncio.to_thread(write_upload, user_dir / request.uid / name, base64.b64decode(encoded))
+    console.print(result)
+    generated_ocr=""
+    valid=False
+    if isinstance(result, dict) and "error" not in result:  # a list/tuple result means no face was found on the card
+        generated_ocr = result.get("ocr_text")
+        valid=True
+        logger.info(f"OCR response received successfully for UID: {request.uid}")
+    if valid:
+        task = asyncio.create_task(warm_reference_face(request.uid))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    return {"text": generated_ocr, "valid":valid}, not (isinstance(result, dict) and "error" in result)
+
+def submit_job(kind: str, uid: str, fn: Callable[[], Awaitable[dict]]) -> dict:
+    """Queue a model request as a job, or reject it with 429 and a Retry-After header when the queue is saturated."""
+    try:
+        job = jobs.submit(kind, uid, fn)
+    except JobQueueFullError as e:
+        logger.warning(f"Rejected {kind} job for UID {uid}: {e!s}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after_s)}) from e
+    logger.info(f"Queued {kind} job {job.id} for UID: {uid}")
+    return job.snapshot()
+
+def find_job(job_id: str) -> Job:
+    """Return a retained job or raise 404."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job {job_id}")
+    return job
+
+@app.post("/jobs/ocr", status_code=202)
+async def submit_ocr_job(request: OCRRequest) -> dict:
+    """Queue an OCR request; the result of `/ocr-content` is served by `/jobs/{job_id}` once done."""
+    return submit_job("ocr", request.uid, lambda: ocr_content(request))
+
+@app.post("/jobs/otp", status_code=202)
+async def submit_otp_job(request: OTPRequest) -> dict:
+    """Queue an OTP validation; the result of `/validate-otp` is served by `/jobs/{job_id}` once done."""
+    return submit_job("otp", request.uid, lambda: validate_otp(request))
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str) -> dict:
+    """Return the status of a job, and its result once done."""
+    return find_job(job_id).snapshot()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str) -> StreamingResponse:
+    """Stream the status of a job as server-sent events, ending with its result."""
+    return StreamingResponse(job_event_stream(find_job(job_id)), media_type="text/event-stream")
+
+async def job_event_stream(job: Job) -> AsyncIterator[str]:
+    """Send a `status` event on every status change and a `result` event once the job is done."""
+    status = job.status
+    yield f"event: status\ndata: {json.dumps(job.snapshot())}\n\n"
+    while not job.done.is_set():
+        try:
+            await asyncio.wait_for(job.done.wait(), JOB_EVENT_KEEPALIVE_S)
+        except TimeoutError:
+            if job.status == status:
+                yield ": keep-alive\n\n"
+                continue
+        status = job.status
+        if not job.done.is_set():
+            yield f"event: status\ndata: {json.dumps(job.snapshot())}\n\n"
+    yield f"event: result\ndata: {json.dumps(job.snapshot())}\n\n"
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """Reject uploads by their Content-Length before the body is received, as form parsing spools the whole body first."""
+    if request.url.path.startswith("/uploads/"):
+        length = request.headers.get("content-length", "")
+        if not length.isdigit():
+            return JSONResponse({"detail": "Uploads need a Content-Length header"}, status_code=411)
+        if int(length) > UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES:
+            return JSONResponse({"detail": f"Upload larger than {UPLOAD_MAX_BYTES // (1024 * 1024)} MiB"}, status_code=413)
+    return await call_next(request)
+
+async def read_upload_file(file: UploadFile) -> bytes:
+    """Read a multipart upload chunk by chunk, rejecting it with 413 once the file itself exceeds `UPLOAD_MAX_MB`."""
+    data = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+        data += chunk
+        if len(data) > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Upload larger than {UPLOAD_MAX_BYTES // (1024 * 1024)} MiB")
+    return bytes(data)
+
+def write_upload(path: Path, data: bytes) -> None:
+    """Write uploaded bytes into the user's folder atomically, logging instead of raising on failure."""
+    try:
+        write_atomic(path, data)
+    except OSError as e:
+        logger.error(f"Failed to persist upload {path}: {e!s}")
+
+def persist_upload(path: Path, data: bytes) -> None:
+    """Persist uploaded bytes in the background, off the request path."""
+    task = asyncio.create_task(asyncio.to_thread(write_upload, path, data))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+@app.post("/uploads/id-proof", status_code=202)
+async def upload_id_proof(
+    uid: Annotated[str, Form(min_length=1, max_length=255, pattern=UID_PATTERN)],
+    file: Annotated[UploadFile, File(description="ID card image.")],
+) -> dict:
+    """Queue OCR on an uploaded ID image, which is sent to the deployment with the request instead of being read from `user_data`."""
+    image = await read_upload_file(file)
+    job = submit_job("ocr", uid, lambda: ocr_verdict_result(OCRRequest(uid=uid), image))
+    result_cache.invalidate(uid)
+    persist_upload(user_dir / uid / "id_proof.jpg", image)
+    return job
+
+@app.post("/uploads/otp-video", status_code=202)
+async def upload_otp_video(
+    uid: Annotated[str, Form(min_length=1, max_length=255, pattern=UID_PATTERN)],
+    otp: Annotated[str, Form(min_length=4, max_length=4, pattern=OTP_PATTERN)],
+    file: Annotated[UploadFile, File(description="OTP recording.")],
+) -> dict:
+    """Queue OTP validation of an uploaded recording, sent to the deployment along with the user's reference face."""
+    video = await read_upload_file(file)
+    uploads = {"video": video, **await reference_upload(uid)}
+    job = submit_job("otp", uid, lambda: otp_verdict_result(OTPRequest(otp=otp, uid=uid), uploads))
+    result_cache.invalidate(uid)
+    persist_upload(user_dir / uid / "recorded_videos" / "live_recording.mp4", video)
+    return job
+
+async def ocr_verdict_result(request: OCRRequest, image: bytes) -> dict:
+    """Return the OCR response for an uploaded image, without the cacheable flag (uploads bypass the result cache)."""
+    return (await ocr_verdict(request, image))[0]
+
+async def otp_verdict_result(request: OTPRequest, uploads: dict[str, bytes]) -> dict:
+    """Return the OTP verdict for an uploaded recording, without the cacheable flag (uploads bypass the result cache)."""
+    return (await otp_verdict(request, uploads))[0]
+
+@app.post("/cache/invalidate/{uid}")
+async def invalidate_cache(uid: Annotated[str, PathParam(min_length=1, max_length=255, pattern=UID_PATTERN)]) -> dict[str, int]:
+    """Drop the cached OCR and OTP results of a user, called by the frontend after it writes new files."""
+    dropped = result_cache.invalidate(uid)
+    logger.info(f"Invalidated {dropped} cached results for UID: {uid}")
+    return {"invalidated": dropped}
+
+@app.get("/cache/stats")
+async def cache_stats() -> dict:
+    """Return the result cache hit rates of this worker, the upstream request coalescing counters and the job queue counters."""
+    return {"cache": result_cache.stats(), "coalescing": in_flight.stats(), "jobs": jobs.stats()}
 
 if __name__ == "__main__":
     logger.info("Starting FastAPI server on 127.0.0.1:8000")
@@ -0,0 +1,207 @@
+"""Content-aware result cache for the FastAPI gateway."""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+    from pathlib import Path
+
+    from backend.single_flight import SingleFlight
+
+DEFAULT_MAX_ENTRIES = 1024
+BACKENDS = ("lru", "sqlite", "none")
+
+
+class LRUCacheBackend:
+    """In-process LRU store of response dicts, private to one gateway worker."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        """Set the entry bound."""
+        self.max_entries = max(1, max_entries)
+        self.entries: OrderedDict[str, tuple[str, dict]] = OrderedDict()  # key -> (uid, value)
+        self.evictions = 0
+
+    def get(self, key: str) -> dict | None:
+        """Return the value for `key` and mark it as recently used."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, uid: str, value: dict) -> None:
+        """Store a value, evicting the least recently used entries beyond the bound."""
+        self.entries[key] = (uid, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, uid: str) -> int:
+        """Drop every entry of `uid` and return how many were dropped."""
+        keys = [key for key, (entry_uid, _) in self.entries.items() if entry_uid == uid]
+        for key in keys:
+            del self.entries[key]
+        return len(keys)
+
+    def __len__(self) -> int:
+        """Return the number of cached entries."""
+        return len(self.entries)
+
+
+class SQLiteCacheBackend:
+    """SQLite store of response dicts shared by the gateway workers of one host (e.g. `uvicorn --workers N`).
+
+    - WAL mode lets the workers read concurrently while one of them writes.
+    - Evicts least recently used entries beyond `max_entries`.
+    """
+
+    def __init__(self, db_path: Path, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        """Open (or create) the cache database."""
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max(1, max_entries)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(db_path), check_same_thread=False, timeout=5.0)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS gateway_results (key TEXT PRIMARY KEY, uid TEXT NOT NULL, value TEXT NOT NULL, last_access REAL NOT NULL)",
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS gateway_results_uid ON gateway_results (uid)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS gateway_results_last_access ON gateway_results (last_access)")
+        self.connection.commit()
+        self.evictions = 0
+
+    def get(self, key: str) -> dict | None:
+        """Return the value for `key` and mark it as recently used."""
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM gateway_results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE gateway_results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, uid: str, value: dict) -> None:
+        """Store a value, evicting the least recently used entries beyond the bound."""
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO gateway_results (key, uid, value, last_access) VALUES (?, ?, ?, ?)",
+                (key, uid, json.dumps(value), time.time()),
+            )
+            evicted = self.connection.execute(
+                "DELETE FROM gateway_results WHERE key IN (SELECT key FROM gateway_results ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            self.connection.commit()
+        self.evictions += evicted
+
+    def invalidate(self, uid: str) -> int:
+        """Drop every entry of `uid` and return how many were dropped."""
+        with self.lock:
+            dropped = self.connection.execute("DELETE FROM gateway_results WHERE uid = ?", (uid,)).rowcount
+            self.connection.commit()
+        return dropped
+
+    def __len__(self) -> int:
+        """Return the number of cached entries."""
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM gateway_results").fetchone()[0]
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self.lock:
+            self.connection.close()
+
+
+def file_fingerprint(path: Path) -> str | None:
+    """Cheap content version of a file from its modification time and size, or None if it does not exist."""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+class GatewayCache:
+    """Caches gateway responses keyed on the uid, the version of the input file they were computed from, and the request.
+
+    - Rewriting `id_proof.jpg` or `live_recording.mp4` changes the key, so stale results are never served.
+    - `invalidate` additionally drops a user's entries as soon as the frontend writes new files.
+    - Only results marked cacheable (no upstream error) are stored; requests without an input file bypass the cache.
+    - Concurrent misses on the same key are coalesced through `in_flight`, so a request on a re-uploaded file
+      never joins a call still running on the previous one.
+    - Hit/miss counters are kept per request kind and per worker process.
+    """
+
+    def __init__(self, backend: LRUCacheBackend | SQLiteCacheBackend | None, in_flight: SingleFlight | None = None) -> None:
+        """Use `backend` for storage; None disables caching. Misses are coalesced through `in_flight`, if given."""
+        self.backend = backend
+        self.in_flight = in_flight
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+
+    async def fetch(self, kind: str, uid: str, source: Path, request_key: str, compute: Callable[[], Awaitable[tuple[dict, bool]]]) -> dict:
+        """Return the cached response for this request on the current `source` file, or `compute()` and cache it.
+
+        `compute` returns the response and whether it may be cached.
+        """
+        fingerprint = file_fingerprint(source)
+        key = f"{kind}:{uid}:{fingerprint}:{request_key}"
+        if self.backend is not None and fingerprint is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self.hits[kind] = self.hits.get(kind, 0) + 1
+                return value
+        self.misses[kind] = self.misses.get(kind, 0) + 1
+        if self.in_flight is None:
+            return await self._compute(key, uid, source, fingerprint, compute)
+        return await self.in_flight.do(key, lambda: self._compute(key, uid, source, fingerprint, compute))
+
+    async def _compute(self, key: str, uid: str, source: Path, fingerprint: str | None, compute: Callable[[], Awaitable[tuple[dict, bool]]]) -> dict:
+        value, cacheable = await compute()
+        # Not stored if the file was rewritten meanwhile, as the response may come from either version
+        if self.backend is not None and fingerprint is not None and cacheable and file_fingerprint(source) == fingerprint:
+            self.backend.put(key, uid, value)
+        return value
+
+    def invalidate(self, uid: str) -> int:
+        """Drop the cached responses of `uid`."""
+        return self.backend.invalidate(uid) if self.backend is not None else 0
+
+    def stats(self) -> dict:
+        """Hit/miss counters and hit rate per request kind, plus the size of the backend."""
+        kinds = {}
+        for kind in sorted(self.hits.keys() | self.misses.keys()):
+            hits, misses = self.hits.get(kind, 0), self.misses.get(kind, 0)
+            kinds[kind] = {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 3)}
+        if self.backend is None:
+            return {"backend": "none", "kinds": kinds}
+        backend = "sqlite" if isinstance(self.backend, SQLiteCacheBackend) else "lru"
+        return {"backend": backend, "entries": len(self.backend), "evictions": self.backend.evictions, "kinds": kinds}
+
+    def close(self) -> None:
+        """Release the backend."""
+        if isinstance(self.backend, SQLiteCacheBackend):
+            self.backend.close()
+
+
+def build_gateway_cache(backend: str, max_entries: int = DEFAULT_MAX_ENTRIES, db_path: Path | None = None, in_flight: SingleFlight | None = None) -> GatewayCache:
+    """Create the gateway cache from its `route_config.toml` settings, coalescing misses through `in_flight`."""
+    if backend not in BACKENDS:
+        msg = f"Unknown gateway cache backend {backend!r}, expected one of {list(BACKENDS)}"
+        raise ValueError(msg)
+    if backend == "sqlite":
+        if db_path is None:
+            msg = "The sqlite gateway cache backend needs a database path"
+            raise ValueError(msg)
+        return GatewayCache(SQLiteCacheBackend(db_path, max_entries), in_flight)
+    if backend == "lru":
+        return GatewayCache(LRUCacheBackend(max_entries), in_flight)
+    return GatewayCache(None, in_flight)
@@ -0,0 +1,146 @@
+"""Bounded asynchronous job queue for the FastAPI gateway."""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+import uuid
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+DEFAULT_MAX_RUNNING = 16
+DEFAULT_MAX_QUEUED = 64
+DEFAULT_RESULT_TTL_S = 300.0
+DURATION_SMOOTHING = 0.2  # weight of the latest job in the moving average of job durations
+
+
+class JobQueueFullError(Exception):
+    """Raised when a job is submitted while the queue is saturated."""
+
+    def __init__(self, retry_after_s: int) -> None:
+        """Record when the client should retry."""
+        super().__init__(f"Job queue is full, retry in {retry_after_s} s")
+        self.retry_after_s = retry_after_s
+
+
+class Job:
+    """A submitted model request and its outcome."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, kind: str, uid: str) -> None:
+        """Create a queued job."""
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.uid = uid
+        self.status = self.QUEUED
+        self.result: dict | None = None
+        self.error: str | None = None
+        self.submitted = time.monotonic()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.done = asyncio.Event()
+
+    def snapshot(self) -> dict:
+        """Return the JSON view of the job served to clients."""
+        view = {"job_id": self.id, "kind": self.kind, "uid": self.uid, "status": self.status}
+        if self.finished is not None:
+            view["duration_ms"] = round((self.finished - self.submitted) * 1000)
+        if self.status == self.DONE:
+            view["result"] = self.result
+        elif self.status == self.FAILED:
+            view["error"] = self.error
+        return view
+
+
+class JobQueue:
+    """Runs submitted jobs in the background with bounded concurrency and a bounded backlog.
+
+    - At most `max_running` jobs run at once; further jobs wait as `queued`.
+    - Submissions beyond `max_queued` waiting jobs are rejected with a retry delay estimated from
+      recent job durations, so overload turns into fast rejections instead of growing latency.
+    - Finished jobs are kept for `result_ttl_s` so clients can collect their results.
+    - Jobs live in the memory of one gateway process, so clients must poll the worker they submitted to.
+    """
+
+    def __init__(self, max_running: int = DEFAULT_MAX_RUNNING, max_queued: int = DEFAULT_MAX_QUEUED, result_ttl_s: float = DEFAULT_RESULT_TTL_S) -> None:
+        """Set the concurrency, backlog and retention bounds."""
+        self.max_running = max(1, max_running)
+        self.max_queued = max(0, max_queued)
+        self.result_ttl_s = result_ttl_s
+        self.slots = asyncio.Semaphore(self.max_running)
+        self.jobs: dict[str, Job] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.mean_duration_s = 1.0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, kind: str, uid: str, fn: Callable[[], Awaitable[dict]]) -> Job:
+        """Start `fn()` as a job, or raise `JobQueueFullError` if the backlog is full."""
+        self._prune()
+        queued = sum(job.status == Job.QUEUED for job in self.jobs.values())
+        if queued >= self.max_queued and self.slots.locked():
+            self.rejected += 1
+            raise JobQueueFullError(self.retry_after_s(queued))
+        job = Job(kind, uid)
+        self.jobs[job.id] = job
+        task = asyncio.create_task(self._run(job, fn))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """Return the job with `job_id`, if it is still retained."""
+        return self.jobs.get(job_id)
+
+    def retry_after_s(self, queued: int) -> int:
+        """Seconds until a slot is likely free, from the mean job duration and the backlog."""
+        return max(1, math.ceil(self.mean_duration_s * (queued + 1) / self.max_running))
+
+    async def _run(self, job: Job, fn: Callable[[], Awaitable[dict]]) -> None:
+        async with self.slots:
+            job.status = Job.RUNNING
+            job.started = time.monotonic()
+            try:
+                job.result = await fn()
+                job.status = Job.DONE
+            except Exception as e:  # noqa: BLE001 - reported to the client polling the job
+                logger.exception(f"{job.kind} job {job.id} failed for UID {job.uid}")
+                job.error = str(e)
+                job.status = Job.FAILED
+            finally:
+                job.finished = time.monotonic()
+                self.mean_duration_s += DURATION_SMOOTHING * (job.finished - job.started - self.mean_duration_s)
+                self.completed += 1
+                job.done.set()
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self.jobs.items() if job.finished is not None and now - job.finished > self.result_ttl_s]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def stats(self) -> dict:
+        """Return the job counters and the current backlog."""
+        statuses = [job.status for job in self.jobs.values()]
+        return {
+            "queued": statuses.count(Job.QUEUED),
+            "running": statuses.count(Job.RUNNING),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "mean_duration_ms": round(self.mean_duration_s * 1000),
+        }
+
+    async def close(self) -> None:
+        """Cancel the jobs that are still queued or running."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -0,0 +1,124 @@
+"""Clients the FastAPI gateway uses to reach the Ray Serve model deployments."""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import time
+from abc import ABC, abstractmethod
+from http import HTTPStatus
+from typing import TYPE_CHECKING
+
+import httpx
+import numpy as np
+import ray
+from ray.exceptions import RayError
+from ray.serve.exceptions import RayServeException
+
+if TYPE_CHECKING:
+    from ray.serve.handle import DeploymentHandle
+
+DEFAULT_TIMEOUT_S = 30.0
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+class ModelClient(ABC):
+    """Sends a JSON-like payload to a model deployment and returns its response dict.
+
+    Failures are returned as `{"error": ...}`, like the deployments themselves report them.
+    `session_id` pins related requests (e.g. the chunks of an OTP stream) to the replica holding their session.
+    At most `max_concurrency` calls are sent upstream at once; further calls wait for a free slot.
+    Every call has a budget of `timeout_s`, including the wait for a slot. The remaining budget is sent to the
+    deployment as `timeout_s`, which stops working on the request once it is spent.
+    `uploads` are file bytes sent along with the payload (see backend/model_server/uploads.py for how they are read).
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, timeout_s: float = DEFAULT_TIMEOUT_S) -> None:
+        """Set the upstream concurrency cap and the per-call time budget."""
+        self.max_concurrency = max(1, max_concurrency)
+        self.slots = asyncio.Semaphore(self.max_concurrency)
+        self.timeout_s = timeout_s
+
+    async def request(self, payload: dict, session_id: str | None = None, uploads: dict[str, bytes] | None = None) -> dict:
+        """Call the deployment with `payload` once a concurrency slot is free."""
+        deadline = time.monotonic() + self.timeout_s
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.timeout_s)
+        except TimeoutError:
+            return {"error": f"No upstream slot free within {self.timeout_s} s"}
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return {"error": f"No upstream slot free within {self.timeout_s} s"}
+            attached = {}
+            for name, data in (uploads or {}).items():
+                attached.update(await self.attach_upload(name, data))
+            return await self._request({**payload, **attached, "timeout_s": remaining}, session_id, remaining)
+        finally:
+            self.slots.release()
+
+    async def attach_upload(self, name: str, data: bytes) -> dict:
+        """Payload fields carrying upload `name`; base64 encoded, as JSON requests need."""
+        return {f"{name}_b64": (await asyncio.to_thread(base64.b64encode, data)).decode()}
+
+    @abstractmethod
+    async def _request(self, payload: dict, session_id: str | None, timeout_s: float) -> dict:
+        """Send `payload` to the deployment within `timeout_s` seconds."""
+
+
+class HTTPModelClient(ModelClient):
+    """Calls a deployment through the Ray Serve HTTP proxy, for a gateway running outside of Ray Serve.
+
+    Requests go through the shared keep-alive `httpx.AsyncClient` attached with `bind`, normally in the app lifespan.
+    """
+
+    def __init__(self, url: str, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, timeout_s: float = DEFAULT_TIMEOUT_S) -> None:
+        """Set the deployment route URL."""
+        super().__init__(max_concurrency, timeout_s)
+        self.url = url
+        self.client: httpx.AsyncClient | None = None
+
+    def bind(self, client: httpx.AsyncClient | None) -> None:
+        """Attach (or detach, with None) the shared connection pool."""
+        self.client = client
+
+    async def _request(self, payload: dict, session_id: str | None, timeout_s: float) -> dict:
+        if self.client is None:
+            return {"error": "Model server client is not started"}
+        headers = {"serve_multiplexed_model_id": session_id} if session_id else None
+        try:
+            # Timing out closes the connection, which makes Ray Serve cancel the request in the replica
+            response = await self.client.post(self.url, json=payload, headers=headers, timeout=timeout_s)
+        except httpx.HTTPError as e:
+            return {"error": f"Model server request failed: {e!s}"}
+        if response.status_code != HTTPStatus.OK:
+            return {"error": f"Model server returned {response.status_code}: {response.text}"}
+        return response.json()
+
+
+class HandleModelClient(ModelClient):
+    """Calls a deployment's `process` method through a deployment handle, skipping the HTTP proxy and JSON encoding.
+
+    Uploads are put into the Ray object store once and passed by reference, so a replica on any node reads
+    them from its local object store without a copy.
+    """
+
+    def __init__(self, handle: DeploymentHandle, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, timeout_s: float = DEFAULT_TIMEOUT_S) -> None:
+        """Wrap the deployment handle."""
+        super().__init__(max_concurrency, timeout_s)
+        self.handle = handle
+
+    async def attach_upload(self, name: str, data: bytes) -> dict:
+        """Payload field referencing upload `name` as a uint8 array in the object store, put from a worker thread."""
+        return {f"{name}_ref": await asyncio.to_thread(ray.put, np.frombuffer(data, dtype=np.uint8))}
+
+    async def _request(self, payload: dict, session_id: str | None, timeout_s: float) -> dict:
+        handle = self.handle.options(multiplexed_model_id=session_id) if session_id else self.handle
+        response = handle.process.remote(payload)
+        try:
+            return await asyncio.wait_for(response, timeout_s)
+        except TimeoutError:
+            response.cancel()  # frees the replica's request slot instead of letting it run for nobody
+            return {"error": f"Model deployment call timed out after {timeout_s:.1f} s"}
+        except (RayError, RayServeException) as e:
+            return {"error": f"Model deployment call failed: {e!s}"}
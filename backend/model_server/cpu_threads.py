@@ -0,0 +1,41 @@
+"""Size the intra-op thread pools of a replica to its Ray CPU allocation."""
+
+from __future__ import annotations
+
+import contextlib
+import math
+import os
+import sys
+
+import cv2
+import ray
+
+# Read by OpenMP / BLAS when their thread pools start; the yaml sets them for the replica processes up front
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def assigned_cpus() -> float | None:
+    """CPUs Ray assigned to the current replica or task, or None outside of Ray."""
+    if not ray.is_initialized():
+        return None
+    return ray.get_runtime_context().get_assigned_resources().get("CPU")
+
+
+def configure_cpu_threads(threads: int | None = None) -> int:
+    """Set the torch, OpenCV and OpenMP thread counts to `threads`, by default the CPU allocation rounded up.
+
+    Without this every library sizes its pool to all host cores, so replicas sharing a node oversubscribe them.
+    torch is only configured if it is already loaded in this process (EasyOCR imports it).
+    """
+    if not threads:
+        cpus = assigned_cpus()
+        threads = max(1, math.ceil(cpus)) if cpus else os.cpu_count() or 1
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    cv2.setNumThreads(threads)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+        with contextlib.suppress(RuntimeError):  # only allowed before the first inter-op parallel work, reconfigures keep the first value
+            torch.set_num_interop_threads(threads)
+    return threads
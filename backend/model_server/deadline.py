@@ -0,0 +1,132 @@
+"""Per-request deadlines and cancellation for the model deployments."""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from ray.serve import metrics
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+WORK_MS_BOUNDARIES = [10, 50, 100, 500, 1000, 5000, 10000, 30000]
+
+
+class DeadlineExceededError(RuntimeError):
+    """Raised by `Deadline.check` once the request's time budget is spent or the request was cancelled."""
+
+    def __init__(self, stage: str, reason: str) -> None:
+        """Record where the work stopped and why."""
+        super().__init__(f"Request {'cancelled' if reason == 'cancelled' else 'deadline exceeded'} during {stage}")
+        self.stage = stage
+        self.reason = reason
+
+
+class Deadline:
+    """Time budget and cancellation flag of one request, checked by the processing loops between units of work.
+
+    - Built from the `timeout_s` budget the gateway sends with each request; without one it never expires.
+    - `cancel` is called on the event loop when the request is abandoned and seen by the worker thread at its next `check`.
+    """
+
+    def __init__(self, timeout_s: float | None = None) -> None:
+        """Start the budget of `timeout_s` seconds, or an unlimited one."""
+        self.started = time.monotonic()
+        self.expires_at = self.started + timeout_s if timeout_s else None
+        self.cancelled = threading.Event()
+
+    @classmethod
+    def from_request(cls, data: dict) -> Deadline:
+        """Deadline of a request payload."""
+        timeout_s = data.get("timeout_s")
+        return cls(float(timeout_s) if timeout_s else None)
+
+    def remaining(self) -> float | None:
+        """Seconds left, or None without a budget."""
+        return None if self.expires_at is None else max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the request arrived."""
+        return (time.monotonic() - self.started) * 1000
+
+    def cancel(self) -> None:
+        """Ask the work of this request to stop at its next check."""
+        self.cancelled.set()
+
+    @property
+    def reason(self) -> str | None:
+        """Why the work should stop (`cancelled` or `deadline`), or None while it may continue."""
+        if self.cancelled.is_set():
+            return "cancelled"
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            return "deadline"
+        return None
+
+    def check(self, stage: str) -> None:
+        """Raise `DeadlineExceededError` if the work of this request should stop."""
+        reason = self.reason
+        if reason is not None:
+            raise DeadlineExceededError(stage, reason)
+
+
+class WastedWork:
+    """Ray Serve metrics for requests abandoned before they completed, and the time spent on them."""
+
+    def __init__(self) -> None:
+        """Create the metrics; must run inside a replica."""
+        self.requests = metrics.Counter(
+            "abandoned_requests",
+            description="Requests whose work stopped because they were cancelled or ran out of time.",
+            tag_keys=("reason",),
+        )
+        self.work_ms = metrics.Histogram(
+            "abandoned_work_ms",
+            description="Processing time spent on abandoned requests before their work stopped.",
+            boundaries=WORK_MS_BOUNDARIES,
+            tag_keys=("reason",),
+        )
+        self.totals: dict[str, int] = {}
+
+    def record(self, reason: str, work_ms: float) -> None:
+        """Count one abandoned request and the time its work ran."""
+        self.requests.inc(tags={"reason": reason})
+        self.work_ms.observe(work_ms, tags={"reason": reason})
+        self.totals[reason] = self.totals.get(reason, 0) + 1
+
+
+async def await_within[T](deadline: Deadline, wasted: WastedWork, start: Callable[[], Awaitable[T]]) -> T:
+    """Run `start()` (typically an executor call) and wait for it only as long as the deadline allows.
+
+    If the request is cancelled or runs out of time, the deadline is cancelled so the work stops at its next check,
+    and this returns right away instead of waiting for it, freeing the request slot of the replica.
+    """
+    if deadline.reason is not None:
+        wasted.record(deadline.reason, 0.0)
+        deadline.check("queue")
+    work = asyncio.ensure_future(start())
+    try:
+        return await asyncio.wait_for(asyncio.shield(work), deadline.remaining())
+    except DeadlineExceededError as e:
+        wasted.record(e.reason, deadline.elapsed_ms())
+        raise
+    except asyncio.CancelledError:
+        _abandon(work, wasted, "cancelled", deadline)
+        raise
+    except TimeoutError as e:
+        _abandon(work, wasted, "deadline", deadline)
+        raise DeadlineExceededError(stage="processing", reason="deadline") from e
+
+
+def _abandon(work: asyncio.Future, wasted: WastedWork, reason: str, deadline: Deadline) -> None:
+    # Stop the work at its next check and count it once it has actually stopped
+    deadline.cancel()
+    work.add_done_callback(lambda finished: _record_abandoned(finished, wasted, reason, deadline))
+
+
+def _record_abandoned(work: asyncio.Future, wasted: WastedWork, reason: str, deadline: Deadline) -> None:
+    if not work.cancelled():
+        work.exception()  # retrieved so abandoned failures are not reported as unhandled
+    wasted.record(reason, deadline.elapsed_ms())
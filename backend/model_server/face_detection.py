@@ -0,0 +1,181 @@
+"""Face detector backends shared by the ID card and video pipelines."""
+
+from __future__ import annotations
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import TYPE_CHECKING, ClassVar
+
+import cv2
+from rich.console import Console
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    import numpy as np
+
+DEFAULT_YUNET_MODEL = Path(__file__).parent / "models" / "face_detection_yunet_2023mar.onnx"  # not bundled, download it from the OpenCV model zoo
+console = Console()
+
+GRAYSCALE_NDIM = 2
+
+FaceBox = tuple[int, int, int, int]  # x, y, w, h
+
+
+class FaceDetector(ABC):
+    """Base class for face detector backends.
+
+    Subclasses implement `_detect`; `detect` accepts a BGR or grayscale image, and `detect_timed` also returns the
+    duration of the call. Each call's duration is passed to `observe` (e.g. a Serve metric) along with the backend name.
+    Subclasses list the attributes that change their detections in `settings`, which `variant` puts into cache keys.
+    """
+
+    name: ClassVar[str] = ""
+    settings: ClassVar[tuple[str, ...]] = ()
+
+    def __init__(self) -> None:
+        """Initialize the detector without a timing observer."""
+        self.cv2_module = cv2
+        self.observe: Callable[[str, float], None] | None = None
+
+    def detect(self, image: np.ndarray) -> list[FaceBox]:
+        """Detect faces in `image`, returning (x, y, w, h) boxes in its pixel coordinates."""
+        return self.detect_timed(image)[0]
+
+    def detect_timed(self, image: np.ndarray) -> tuple[list[FaceBox], float]:
+        """Detect faces in `image` and return them with the duration of this call in milliseconds."""
+        start = time.perf_counter()
+        faces = self._detect(image)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if self.observe is not None:
+            self.observe(self.name, elapsed_ms)
+        return faces, elapsed_ms
+
+    def variant(self) -> str:
+        """Return the backend name and its detection settings, so cached results of another configuration are not reused."""
+        return ",".join([self.name, *(f"{setting}={getattr(self, setting)}" for setting in self.settings)])
+
+    @abstractmethod
+    def _detect(self, image: np.ndarray) -> list[FaceBox]: ...
+
+    def to_gray(self, image: np.ndarray) -> np.ndarray:
+        """Return a grayscale view of `image`."""
+        return image if image.ndim == GRAYSCALE_NDIM else self.cv2_module.cvtColor(image, self.cv2_module.COLOR_BGR2GRAY)
+
+
+class HaarFaceDetector(FaceDetector):
+    """Haar cascade run on the full-resolution grayscale image (the original detector)."""
+
+    name = "haar"
+    settings = ("scale_factor", "min_neighbors", "min_size")
+
+    def __init__(self, scale_factor: float = 1.1, min_neighbors: int = 5, min_size: int = 50) -> None:
+        """Load the frontal face cascade."""
+        super().__init__()
+        self.face_cascade = self.cv2_module.CascadeClassifier(self.cv2_module.data.haarcascades + "haarcascade_frontalface_default.xml")
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+
+    def _detect(self, image: np.ndarray) -> list[FaceBox]:
+        return self.cascade(self.to_gray(image), self.min_size)
+
+    def cascade(self, gray: np.ndarray, min_size: int) -> list[FaceBox]:
+        """Run the cascade on `gray`."""
+        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors, minSize=(min_size, min_size))
+        return [tuple(int(v) for v in face) for face in faces]
+
+
+class DownscaledHaarFaceDetector(HaarFaceDetector):
+    """Haar cascade run on a downscaled image, with each hit refined at full resolution inside a padded ROI."""
+
+    name = "haar_refine"
+    settings = (*HaarFaceDetector.settings, "detect_width", "refine_margin")
+
+    def __init__(self, detect_width: int = 320, refine_margin: float = 0.25, **haar_options: float) -> None:
+        """Set the width of the coarse pass and the ROI margin used for refinement."""
+        super().__init__(**haar_options)
+        self.detect_width = detect_width
+        self.refine_margin = refine_margin
+
+    def _detect(self, image: np.ndarray) -> list[FaceBox]:
+        gray = self.to_gray(image)
+        scale = self.detect_width / gray.shape[1]
+        if scale >= 1.0:
+            return self.cascade(gray, self.min_size)
+
+        small = self.cv2_module.resize(gray, None, fx=scale, fy=scale, interpolation=self.cv2_module.INTER_AREA)
+        faces = []
+        for x, y, w, h in self.cascade(small, max(int(self.min_size * scale), 1)):
+            fx, fy, fw, fh = int(x / scale), int(y / scale), int(w / scale), int(h / scale)
+            margin_x, margin_y = int(fw * self.refine_margin), int(fh * self.refine_margin)
+            x0, y0 = max(fx - margin_x, 0), max(fy - margin_y, 0)
+            x1, y1 = min(fx + fw + margin_x, gray.shape[1]), min(fy + fh + margin_y, gray.shape[0])
+            refined = self.cascade(gray[y0:y1, x0:x1], max(self.min_size, fw // 2))
+            if refined:
+                rx, ry, rw, rh = max(refined, key=lambda f: f[2] * f[3])
+                faces.append((x0 + rx, y0 + ry, rw, rh))
+            else:
+                faces.append((fx, fy, fw, fh))
+        return faces
+
+
+class YuNetFaceDetector(FaceDetector):
+    """OpenCV DNN detector (YuNet ONNX model) loaded from a local model file, no network access needed."""
+
+    name = "yunet"
+    settings = ("model_name", "input_width", "score_threshold", "nms_threshold")
+
+    def __init__(self, model_path: str | Path = DEFAULT_YUNET_MODEL, input_width: int = 320, score_threshold: float = 0.7, nms_threshold: float = 0.3) -> None:
+        """Load the ONNX model through cv2.FaceDetectorYN."""
+        super().__init__()
+        model_path = Path(model_path)
+        if not model_path.is_file():
+            msg = f"YuNet model not found at {model_path}. Place face_detection_yunet_2023mar.onnx there or set `model_path`."
+            raise FileNotFoundError(msg)
+        self.model_name = model_path.name
+        self.input_width = input_width
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        self.detector = self.cv2_module.FaceDetectorYN.create(str(model_path), "", (input_width, input_width), score_threshold, nms_threshold)
+        self.detector_lock = threading.Lock()  # FaceDetectorYN keeps its input size as state
+
+    def _detect(self, image: np.ndarray) -> list[FaceBox]:
+        bgr = self.cv2_module.cvtColor(image, self.cv2_module.COLOR_GRAY2BGR) if image.ndim == GRAYSCALE_NDIM else image
+        scale = min(1.0, self.input_width / bgr.shape[1])
+        resized = self.cv2_module.resize(bgr, None, fx=scale, fy=scale, interpolation=self.cv2_module.INTER_AREA) if scale < 1.0 else bgr
+        with self.detector_lock:
+            self.detector.setInputSize((resized.shape[1], resized.shape[0]))
+            _, faces = self.detector.detect(resized)
+        if faces is None:
+            return []
+        return [tuple(int(v / scale) for v in face[:4]) for face in faces]
+
+
+FACE_DETECTORS: dict[str, type[FaceDetector]] = {cls.name: cls for cls in (HaarFaceDetector, DownscaledHaarFaceDetector, YuNetFaceDetector)}
+
+
+def build_face_detector(config: dict | None = None, observe: Callable[[str, float], None] | None = None) -> FaceDetector:
+    """Create the backend named by `config["backend"]` (default `haar`) with `config["options"]` as keyword arguments.
+
+    `observe` is called with the backend name and the duration in milliseconds of every detection.
+
+    The YuNet model file is not part of the repository; `yunet` falls back to `haar` with a warning when it is missing,
+    so a replica still starts.
+    """
+    config = config or {}
+    backend = config.get("backend", HaarFaceDetector.name)
+    if backend not in FACE_DETECTORS:
+        msg = f"Unknown face detector backend {backend!r}, expected one of {sorted(FACE_DETECTORS)}"
+        raise ValueError(msg)
+    options = config.get("options", {})
+    if backend == YuNetFaceDetector.name:
+        model_path = Path(options.get("model_path", DEFAULT_YUNET_MODEL))
+        if not model_path.is_file():
+            console.print(f"[yellow]⚠️ YuNet model not found at {model_path}, using the haar face detector[/yellow]")
+            backend, options = HaarFaceDetector.name, {}
+    detector = FACE_DETECTORS[backend](**options)
+    detector.observe = observe
+    return detector
@@ -0,0 +1,121 @@
+"""Batched SSIM face similarity with an aggregate decision policy."""
+
+from __future__ import annotations
+
+from typing import NamedTuple
+
+import numpy as np
+
+SSIM_WIN_SIZE = 7
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+UINT8_DATA_RANGE = 255.0
+DEFAULT_CHUNK_SIZE = 4
+POLICIES = ("all", "majority", "mean")
+
+
+class FaceMatch(NamedTuple):
+    """Outcome of comparing candidate face crops against a reference face."""
+
+    passed: bool
+    scores: list[float]  # scores of the crops evaluated before the decision was determined, in input order
+    policy: str
+    evaluated: int
+
+
+def _window_means(stack: np.ndarray, win_size: int) -> np.ndarray:
+    # Means over every fully contained win_size x win_size window of each image, via summed-area tables
+    table = np.pad(stack, ((0, 0), (1, 0), (1, 0))).cumsum(axis=1).cumsum(axis=2)
+    sums = table[:, win_size:, win_size:] - table[:, :-win_size, win_size:] - table[:, win_size:, :-win_size] + table[:, :-win_size, :-win_size]
+    return sums / (win_size * win_size)
+
+
+def ssim_batch(reference: np.ndarray, candidates: np.ndarray, win_size: int = SSIM_WIN_SIZE, data_range: float = UINT8_DATA_RANGE) -> np.ndarray:
+    """Mean SSIM of each grayscale candidate in an (N, H, W) stack against an (H, W) reference, in one vectorized pass.
+
+    Matches `skimage.metrics.structural_similarity` defaults: uniform window, sample covariance, border windows excluded.
+    """
+    if candidates.shape[1:] != reference.shape:
+        msg = f"Candidate crops {candidates.shape[1:]} do not match the reference face {reference.shape}"
+        raise ValueError(msg)
+    ref = reference.astype(np.float64)[np.newaxis]
+    cand = candidates.astype(np.float64)
+
+    ux = _window_means(ref, win_size)
+    uy = _window_means(cand, win_size)
+    uxx = _window_means(ref * ref, win_size)
+    uyy = _window_means(cand * cand, win_size)
+    uxy = _window_means(ref * cand, win_size)
+
+    cov_norm = win_size**2 / (win_size**2 - 1)
+    vx = cov_norm * (uxx - ux * ux)
+    vy = cov_norm * (uyy - uy * uy)
+    vxy = cov_norm * (uxy - ux * uy)
+
+    c1 = (SSIM_K1 * data_range) ** 2
+    c2 = (SSIM_K2 * data_range) ** 2
+    ssim_map = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux * ux + uy * uy + c1) * (vx + vy + c2))
+    return ssim_map.mean(axis=(1, 2))
+
+
+class FaceSimilarity:
+    """Decides whether a stack of face crops matches a reference face.
+
+    - `all`: every crop must score at least `threshold`.
+    - `majority`: more than half of the crops must score at least `threshold`.
+    - `mean`: the mean score must be at least `threshold`.
+
+    Crops are scored in vectorized chunks of `chunk_size`, and scoring stops once the remaining
+    crops can no longer change the decision (SSIM is bounded by [-1, 1]).
+    """
+
+    def __init__(self, threshold: float, policy: str = "all", chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        """Set the score threshold and the aggregate decision policy."""
+        if policy not in POLICIES:
+            msg = f"Unknown face similarity policy {policy!r}, expected one of {list(POLICIES)}"
+            raise ValueError(msg)
+        self.threshold = threshold
+        self.policy = policy
+        self.chunk_size = max(1, chunk_size)
+
+    def compare(self, reference: np.ndarray, candidates: np.ndarray) -> FaceMatch:
+        """Score an (N, H, W) stack of grayscale crops against the reference and apply the policy."""
+        scores: list[float] = []
+        total = len(candidates)
+        decision = self.decide(scores, total)
+        while decision is None:
+            chunk = candidates[len(scores) : len(scores) + self.chunk_size]
+            scores.extend(float(score) for score in ssim_batch(reference, chunk))
+            decision = self.decide(scores, total)
+        return FaceMatch(decision, scores, self.policy, len(scores))
+
+    def decide(self, scores: list[float], total: int) -> bool | None:
+        """Return the decision if the `scores` of the first crops already determine it for `total` crops, else None."""
+        remaining = total - len(scores)
+        if self.policy == "all":
+            return self._decide_all(scores, remaining)
+        if self.policy == "majority":
+            return self._decide_majority(scores, remaining, total)
+        return self._decide_mean(scores, remaining, total)
+
+    def _decide_all(self, scores: list[float], remaining: int) -> bool | None:
+        if any(score < self.threshold for score in scores):
+            return False
+        return True if remaining == 0 else None
+
+    def _decide_majority(self, scores: list[float], remaining: int, total: int) -> bool | None:
+        passes = sum(score >= self.threshold for score in scores)
+        if passes * 2 > total:
+            return True
+        if (passes + remaining) * 2 <= total:
+            return False
+        return None
+
+    def _decide_mean(self, scores: list[float], remaining: int, total: int) -> bool | None:
+        if total == 0:
+            return False
+        if (sum(scores) - remaining) / total >= self.threshold:
+            return True  # even if every remaining crop scored -1
+        if (sum(scores) + remaining) / total < self.threshold:
+            return False  # even if every remaining crop scored 1
+        return None
@@ -3,19 +3,26 @@
 from __future__ import annotations
 
 import re
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import TYPE_CHECKING
 
 import cv2
 
 if TYPE_CHECKING:
+    from collections.abc import Callable
     from pathlib import Path
 
+    from backend.model_server.face_detection import FaceDetector
+
 import ssl
 
 import easyocr
 import numpy as np
 from rich.console import Console
 
+from backend.model_server.deadline import Deadline
+from backend.model_server.face_detection import HaarFaceDetector
+
 ssl._create_default_https_context = ssl._create_unverified_context
 
 
@@ -24,6 +31,68 @@ console = Console()
 MIN_WORD_LENGTH = 3
 MIN_SIMILARITY_SCORE = 0.4
 NAME_LENGTH = 3
+ORIENTATION_MAX_SIDE = 640  # longest side used for the detection-only orientation pass
+ORIENTATION_AMBIGUITY_RATIO = 1.5  # below this width/height ratio both text axes are tried
+UPRIGHT_ANGLES = [0, 180]
+SIDEWAYS_ANGLES = [90, 270]
+DEFAULT_MAX_IMAGE_SIDE = 1600  # longest side uploads are normalised to before filtering and OCR
+DEFAULT_TARGET_TEXT_HEIGHT = 40  # text line height (px) recognition runs at, 0 disables text-height scaling
+TEXT_HEIGHT_TOLERANCE = 1.25  # only rescale when text is this much taller than the target
+JPEG_REDUCTION_FLAGS = {8: cv2.IMREAD_REDUCED_COLOR_8, 4: cv2.IMREAD_REDUCED_COLOR_4, 2: cv2.IMREAD_REDUCED_COLOR_2}
+JPEG_MARKER_PREFIX = 0xFF
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def read_jpeg_size(data: bytes) -> tuple[int, int] | None:
+    """Read (width, height) from the JPEG frame header without decoding the image."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != JPEG_MARKER_PREFIX:
+            return None
+        marker = data[i + 1]
+        if marker == JPEG_MARKER_PREFIX:  # fill byte
+            i += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            return int.from_bytes(data[i + 7 : i + 9], "big"), int.from_bytes(data[i + 5 : i + 7], "big")
+        i += 2 + int.from_bytes(data[i + 2 : i + 4], "big")
+    return None
+
+
+class ArtifactWriter:
+    """JPEG encodes the user artifacts and runs background persistence work on a single writer thread.
+
+    The rotated card and face crop are encoded on the request path and written atomically before the response
+    (see `IDOCRProcessor.write_user_artifacts`). Only debug images and result cache inserts are queued on the thread.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the single writer thread."""
+        self.cv2_module = cv2
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifact_writer")
+
+    def write(self, path: Path, image: np.ndarray) -> Future:
+        """Queue an image to be written to `path`."""
+        return self.executor.submit(self._write, path, image)
+
+    def submit(self, fn: Callable[..., None], *args: object) -> Future:
+        """Run other background persistence work in order with the queued writes."""
+        return self.executor.submit(fn, *args)
+
+    def encode(self, image: np.ndarray) -> bytes:
+        """Encode an image as JPEG bytes."""
+        ok, buffer = self.cv2_module.imencode(".jpg", image)
+        if not ok:
+            msg = "Could not encode image as JPEG"
+            raise RuntimeError(msg)
+        return buffer.tobytes()
+
+    def _write(self, path: Path, image: np.ndarray) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.cv2_module.imwrite(str(path), image):
+            console.print(f"[red]⚠️ Could not write artifact:[/red] {path}")
 
 
 class ImageProcessor:
@@ -31,13 +100,22 @@ class ImageProcessor:
 
     - Converting Image to GrayScale, Blurring, and Noise Reduction.
     - Rotating Image in 4 angles to find best angle for image OCR data and face extraction.
+
+    Images are passed between the stages as decoded arrays; intermediate images are only
+    written (through the optional `artifact_writer`) when debug artifacts are requested.
+
+    Uploads are normalised to at most `max_image_side` pixels on decode, and recognition is run with
+    text lines scaled to about `target_text_height` pixels, so OCR cost does not grow with upload size.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, artifact_writer: ArtifactWriter | None = None) -> None:
         """Initialize the EasyOCR, CV2 Reader."""
         self.re = re
         self.cv2_module = cv2
         self.reader = easyocr.Reader(["en"])
+        self.artifact_writer = artifact_writer
+        self.max_image_side = DEFAULT_MAX_IMAGE_SIDE
+        self.target_text_height = DEFAULT_TARGET_TEXT_HEIGHT
 
     def extract_details(self, ocr_text: str) -> dict:
         """Extract Name, DOB, and Aadhaar Number from OCR text."""
@@ -61,6 +139,10 @@ class ImageProcessor:
 
         return details
 
+    def has_key_details(self, details: dict) -> bool:
+        """Check whether the extracted details already contain both DOB and Aadhaar number."""
+        return "dob" in details and "aadhaar_number" in details
+
     def get_text_score(self, text: str) -> float:
         """Assign a score to extracted text.
 
@@ -105,88 +187,200 @@ class ImageProcessor:
 
         return self.cv2_module.warpAffine(image, new_matrix, (new_w, new_h))
 
-    def preprocess_image(self, image_path: Path) -> tuple[np.ndarray | None, Path]:
-        """Preprocess the image for better OCR accuracy."""
-        image = self.cv2_module.imread(str(image_path))
-        if image is None:
-            return None, image_path
+    def decode_image(self, data: bytes | None) -> np.ndarray | None:
+        """Decode encoded image bytes into a BGR array no larger than `max_image_side`.
 
+        Large JPEGs are decoded at 1/2, 1/4 or 1/8 scale directly by the decoder before the final resize.
+        """
+        if not data:
+            return None
+        flags = self.cv2_module.IMREAD_COLOR
+        jpeg_size = read_jpeg_size(data)
+        if jpeg_size is not None and self.max_image_side > 0:
+            long_side = max(jpeg_size)
+            for factor, reduced_flag in JPEG_REDUCTION_FLAGS.items():
+                if long_side // factor >= self.max_image_side:
+                    flags = reduced_flag
+                    break
+        image = self.cv2_module.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+        return None if image is None else self.normalize_resolution(image)
+
+    def normalize_resolution(self, image: np.ndarray) -> np.ndarray:
+        """Downscale the image so its longest side is at most `max_image_side`."""
+        long_side = max(image.shape[:2])
+        if self.max_image_side <= 0 or long_side <= self.max_image_side:
+            return image
+        scale = self.max_image_side / long_side
+        return self.cv2_module.resize(image, None, fx=scale, fy=scale, interpolation=self.cv2_module.INTER_AREA)
+
+    def scale_to_text_height(self, gray: np.ndarray, text_height: float | None) -> np.ndarray:
+        """Downscale the image for recognition when its text lines are taller than `target_text_height`."""
+        if not text_height or self.target_text_height <= 0 or text_height <= self.target_text_height * TEXT_HEIGHT_TOLERANCE:
+            return gray
+        scale = self.target_text_height / text_height
+        return self.cv2_module.resize(gray, None, fx=scale, fy=scale, interpolation=self.cv2_module.INTER_AREA)
+
+    def preprocess_image(self, image: np.ndarray, debug_dir: Path | None = None) -> np.ndarray:
+        """Preprocess the image for better OCR accuracy."""
         gray = self.cv2_module.cvtColor(image, self.cv2_module.COLOR_BGR2GRAY)
         gray = self.cv2_module.bilateralFilter(gray, 9, 75, 75)
 
-        processed_path = image_path.parent / "Processed_ID_Card.jpg"
-        self.cv2_module.imwrite(str(processed_path), gray)
-        return gray, processed_path
-
-    def perform_ocr(self, image_path: Path) -> tuple[str, Path]:
-        """Try OCR on different rotations and pick the best one."""
-        gray, processed_path = self.preprocess_image(image_path)
-        if gray is None:
-            return "Image could not be processed.", processed_path
-
-        rotations = [0, 90]
-        best_score = float("-inf")
-        for angle in rotations:
-            rotated_text = " ".join(self.reader.readtext(self.rotate_image(gray, angle), detail=0))
-
-            console.print(f"[cyan]Rotation:[/cyan] {angle}°")
-            console.print(f"[green]Rotated Text:[/green] {rotated_text}")
-
-            score = self.get_text_score(rotated_text)
-            if angle == 0:
-                score += 10  # Small bias towards 0°
-            console.print(f"[yellow]Score:[/yellow] {score}")
-
-            if score > best_score:
-                best_score = score
-                best_text = rotated_text
-                best_angle = angle
-
-        if best_score == float("-inf"):
-            return "No meaningful text found.", processed_path
-
+        if debug_dir is not None and self.artifact_writer is not None:
+            self.artifact_writer.write(debug_dir / "Processed_ID_Card.jpg", gray)
+        return gray
+
+    def read_texts(self, images: list[np.ndarray]) -> list[str]:
+        """Run OCR on a list of images, using one batched EasyOCR call when there is more than one."""
+        if len(images) == 1:
+            return [" ".join(self.reader.readtext(images[0], detail=0))]
+
+        # readtext_batched stacks its inputs, so pad every image to the largest shape in the batch
+        max_h = max(image.shape[0] for image in images)
+        max_w = max(image.shape[1] for image in images)
+        padded = [
+            self.cv2_module.copyMakeBorder(image, 0, max_h - image.shape[0], 0, max_w - image.shape[1], self.cv2_module.BORDER_CONSTANT, value=0)
+            for image in images
+        ]
+        return [" ".join(texts) for texts in self.reader.readtext_batched(padded, detail=0)]
+
+    def estimate_orientation(self, gray: np.ndarray) -> tuple[list[int], float | None]:
+        """Order the candidate rotations using text-line geometry from a low-resolution detection-only pass.
+
+        Text lines of an upright (0°/180°) card are wider than they are tall, those of a sideways (90°/270°)
+        card are taller than they are wide. The other axis is only kept as a fallback when the geometry is ambiguous.
+        Also returns the median text line height, in pixels of `gray`.
+        """
+        scale = min(1.0, ORIENTATION_MAX_SIDE / max(gray.shape[:2]))
+        small = self.cv2_module.resize(gray, None, fx=scale, fy=scale, interpolation=self.cv2_module.INTER_AREA) if scale < 1.0 else gray
+        horizontal_list, free_list = self.reader.detect(small)
+
+        boxes = [(x_max - x_min, y_max - y_min) for x_min, x_max, y_min, y_max in horizontal_list[0]]
+        for box in free_list[0]:
+            xs, ys = [point[0] for point in box], [point[1] for point in box]
+            boxes.append((max(xs) - min(xs), max(ys) - min(ys)))
+        width_sum = sum(w for w, _ in boxes)
+        height_sum = sum(h for _, h in boxes)
+
+        if width_sum == 0 or height_sum == 0:
+            return UPRIGHT_ANGLES + SIDEWAYS_ANGLES, None  # no text found, let recognition decide
+
+        text_height = float(np.median([min(w, h) for w, h in boxes])) / scale
+        primary, fallback = (UPRIGHT_ANGLES, SIDEWAYS_ANGLES) if width_sum >= height_sum else (SIDEWAYS_ANGLES, UPRIGHT_ANGLES)
+        ratio = max(width_sum, height_sum) / min(width_sum, height_sum)
+        console.print(f"[cyan]Text line width/height ratio:[/cyan] {ratio:.2f} [cyan]Text height:[/cyan] {text_height:.1f}px [cyan]Candidates:[/cyan] {primary}")
+        return (primary if ratio >= ORIENTATION_AMBIGUITY_RATIO else primary + fallback), text_height
+
+    def prepare_for_ocr(self, image: np.ndarray, debug_dir: Path | None = None) -> tuple[np.ndarray, list[int]]:
+        """Preprocess the image, order its candidate rotations and scale it to the target text height."""
+        gray = self.preprocess_image(image, debug_dir)
+        candidates, text_height = self.estimate_orientation(gray)
+        return self.scale_to_text_height(gray, text_height), candidates
+
+    def score_rotation(self, rotated_text: str, angle: int) -> float:
+        """Score the text recognised at one rotation."""
+        console.print(f"[cyan]Rotation:[/cyan] {angle}°")
+        console.print(f"[green]Rotated Text:[/green] {rotated_text}")
+
+        score = self.get_text_score(rotated_text)
+        if angle == 0:
+            score += 10  # Small bias towards 0°
+        console.print(f"[yellow]Score:[/yellow] {score}")
+        return score
+
+    def perform_ocr(self, image: np.ndarray | None, debug_dir: Path | None = None) -> tuple[dict | str, np.ndarray | None]:
+        """Try OCR on the likely rotations and pick the best one."""
+        return self.perform_ocr_batch([image], None if debug_dir is None else [debug_dir])[0]
+
+    def perform_ocr_batch(
+        self,
+        images: list[np.ndarray | None],
+        debug_dirs: list[Path] | None = None,
+        deadlines: list[Deadline] | None = None,
+    ) -> list[tuple[dict | str, np.ndarray | None]]:
+        """Try OCR on the likely rotations for several images, with one batched OCR call per round.
+
+        Each image is recognised at its candidate angles in order and drops out of the batch as soon
+        as DOB and Aadhaar number are found, so full recognition normally runs only once per image.
+        Images whose request deadline has passed drop out before the next round.
+        Returns the extracted details and the colour image rotated to the best angle.
+        """
+        results: list[tuple[dict | str, np.ndarray | None] | None] = [None] * len(images)
+        deadlines = deadlines or [Deadline() for _ in images]
+        preprocessed: dict[int, np.ndarray] = {}
+        candidates: dict[int, list[int]] = {}
+        for i, image in enumerate(images):
+            if image is None:
+                results[i] = ("Image could not be processed.", None)
+            else:
+                preprocessed[i], candidates[i] = self.prepare_for_ocr(image, None if debug_dirs is None else debug_dirs[i])
+        pending = list(preprocessed)
+
+        best_score = dict.fromkeys(pending, float("-inf"))
+        best_text: dict[int, str] = {}
+        best_angle: dict[int, int] = {}
+        resolved: set[int] = set()
+        round_index = 0
+        while active := [i for i in pending if i not in resolved and round_index < len(candidates[i]) and deadlines[i].reason is None]:
+            rotated_texts = self.read_texts([self.rotate_image(preprocessed[i], candidates[i][round_index]) for i in active])
+            for i, rotated_text in zip(active, rotated_texts, strict=True):
+                angle = candidates[i][round_index]
+                score = self.score_rotation(rotated_text, angle)
+                if score > best_score[i]:
+                    best_score[i] = score
+                    best_text[i] = rotated_text
+                    best_angle[i] = angle
+
+                if self.has_key_details(self.extract_details(rotated_text)):
+                    # DOB and Aadhaar found, no other rotation can do better
+                    best_text[i] = rotated_text
+                    best_angle[i] = angle
+                    resolved.add(i)
+            round_index += 1
+
+        for i in pending:
+            if deadlines[i].reason is not None:
+                results[i] = (f"Request {deadlines[i].reason} during OCR.", None)
+            elif best_score[i] == float("-inf"):
+                results[i] = ("No meaningful text found.", None)
+            else:
+                results[i] = self.select_best_rotation(images[i], best_text[i], best_angle[i])
+
+        return results
+
+    def select_best_rotation(self, image: np.ndarray, best_text: str, best_angle: int) -> tuple[dict, np.ndarray]:
+        """Extract details from the winning rotation and rotate the ID card to that angle."""
         extracted_details = self.extract_details(best_text)
 
         console.print(f"[cyan]Best Rotation:[/cyan] {best_angle}°")
         console.print(f"[green]Extracted Text:[/green] {best_text}")
 
-        best_rotated_image = self.rotate_image(self.cv2_module.imread(str(image_path)), best_angle)
-        final_processed_path = image_path.parent / "Processed_ID_Card_Best_angle.jpg"
-        self.cv2_module.imwrite(str(final_processed_path), best_rotated_image)
-
-        return extracted_details, final_processed_path
+        return extracted_details, self.rotate_image(image, best_angle)
 
 
 class FaceProcessor:
     """Handles face extraction and comparison using OpenCV.
 
-    - Extracting faces from images.
+    - Extracting faces from images with a pluggable detector backend (Haar cascade by default).
     - Comparing faces using ORB feature matching.
     """
 
-    def __init__(self) -> None:
-        """Initialize the face detector using Haar cascade."""
+    def __init__(self, face_detector: FaceDetector | None = None) -> None:
+        """Initialize the face detector (Haar cascade unless another backend is given)."""
         self.cv2_module = cv2
-        self.face_cascade = self.cv2_module.CascadeClassifier(self.cv2_module.data.haarcascades + "haarcascade_frontalface_default.xml")
+        self.face_detector = face_detector or HaarFaceDetector()
         self.bf = self.cv2_module.BFMatcher(self.cv2_module.NORM_HAMMING, crossCheck=True)
         self.orb = self.cv2_module.ORB_create()
 
-    def extract_face(self, image_path: Path, save_path: Path) -> np.ndarray | None:
-        """Extract and save face, returning the face region."""
-        image = self.cv2_module.imread(str(image_path))
-        gray = self.cv2_module.cvtColor(image, self.cv2_module.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(50, 50))
-        console.print(f"[green]save_path:[/green] {save_path}")
+    def extract_face(self, image: np.ndarray) -> np.ndarray | None:
+        """Extract the face, returning the face region resized to 200x200."""
+        faces, detect_ms = self.face_detector.detect_timed(image)
+        console.print(f"[cyan]Face detection ({self.face_detector.name}):[/cyan] {detect_ms:.1f} ms")
         if len(faces) == 0:
-            console.print(f"[red]⚠️ No face detected in image:[/red] {image_path}")
+            console.print("[red]⚠️ No face detected in image[/red]")
             return None
 
         # Select the largest detected face
         x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
         face_image = image[y : y + h, x : x + w]
 
-        face_image = self.cv2_module.resize(face_image, (200, 200))
-
-        self.cv2_module.imwrite(str(save_path), face_image)
-
-        return face_image
+        return self.cv2_module.resize(face_image, (200, 200))
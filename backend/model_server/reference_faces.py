@@ -0,0 +1,88 @@
+"""In-memory cache of per-user reference faces for the video verification deployment."""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+import cv2
+import numpy as np
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+DEFAULT_MAX_REFERENCE_FACES = 256
+
+
+class ReferenceFaceCache:
+    """Bounded LRU cache of grayscale reference faces keyed by uid.
+
+    - An entry is reused while the file's mtime and size are unchanged, which only needs a `stat`,
+      so repeat logins do not read or decode the reference image again.
+    - A re-registration rewrites the file and therefore invalidates the entry.
+    - Reference faces sent with a request (`get_encoded`) are reused while the same bytes are sent, keyed on their digest,
+      so replicas that do not share the `user_data` folder still skip the decode.
+    - The least recently used uid is dropped once `max_entries` is exceeded.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_REFERENCE_FACES) -> None:
+        """Initialize an empty cache."""
+        self.cv2_module = cv2
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[tuple[int, int] | bytes, np.ndarray]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, uid: str, path: Path) -> np.ndarray | None:
+        """Return the grayscale reference face for `uid`, loading it from `path` if missing or stale."""
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self.invalidate(uid)
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+        face = self._lookup(uid, signature)
+        if face is None:
+            face = self._store(uid, signature, self.cv2_module.imread(str(path), self.cv2_module.IMREAD_GRAYSCALE))
+        return face
+
+    def get_encoded(self, uid: str, data: bytes | memoryview) -> np.ndarray | None:
+        """Return the grayscale reference face for `uid` decoded from the JPEG encoded `data` sent with a request."""
+        signature = hashlib.blake2b(data, digest_size=16).digest()
+        face = self._lookup(uid, signature)
+        if face is None:
+            face = self._store(uid, signature, self.cv2_module.imdecode(np.frombuffer(data, dtype=np.uint8), self.cv2_module.IMREAD_GRAYSCALE))
+        return face
+
+    def _lookup(self, uid: str, signature: tuple[int, int] | bytes) -> np.ndarray | None:
+        with self.lock:
+            entry = self.entries.get(uid)
+            if entry is not None and entry[0] == signature:
+                self.entries.move_to_end(uid)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return None
+
+    def _store(self, uid: str, signature: tuple[int, int] | bytes, face: np.ndarray | None) -> np.ndarray | None:
+        if face is None:
+            return None
+        with self.lock:
+            self.entries[uid] = (signature, face)
+            self.entries.move_to_end(uid)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return face
+
+    def invalidate(self, uid: str) -> None:
+        """Drop the entry for `uid`."""
+        with self.lock:
+            self.entries.pop(uid, None)
+
+    def stats(self) -> dict[str, int]:
+        """Return the hit/miss counters and the number of cached faces."""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
@@ -0,0 +1,137 @@
+"""Persistent content-addressed cache for ID OCR and face extraction results."""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+# Bump whenever a change to the OCR / face extraction pipeline changes its output,
+# so results produced by the previous pipeline are no longer served.
+PIPELINE_VERSION = "4"
+BUSY_TIMEOUT_S = 5.0  # wait for another replica's write lock on the shared database file before giving up
+
+
+class CachedResult(NamedTuple):
+    """Cached output of the ID pipeline for one image."""
+
+    details: dict | str
+    card: bytes | None  # ID card rotated to its best angle, JPEG encoded
+    face: bytes | None  # extracted face crop, JPEG encoded
+
+
+class OCRResultCache:
+    """SQLite-backed LRU cache keyed on a hash of the ID image bytes and the pipeline version.
+
+    - Survives replica restarts since entries live in a local database file.
+    - The replicas of a host share the file: it runs in WAL mode so reads never block on a writer, and lookups only read.
+      Access times of hits are kept in memory and written with the next insert.
+    - Evicts least recently used entries once the stored payload exceeds `max_bytes`.
+    - Counts hits, misses, evictions and database errors. A database error (e.g. a lock held past `BUSY_TIMEOUT_S`)
+      makes a lookup miss and drops an insert instead of failing the request.
+    - Once closed, lookups miss and inserts are dropped, so requests still holding a replaced cache keep working.
+    """
+
+    def __init__(self, db_path: Path, max_bytes: int) -> None:
+        """Open (or create) the cache database."""
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(db_path), timeout=BUSY_TIMEOUT_S, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_results ("
+            "key TEXT PRIMARY KEY, details TEXT NOT NULL, card BLOB, face BLOB, size INTEGER NOT NULL, last_access REAL NOT NULL)",
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ocr_results_last_access ON ocr_results (last_access)")
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self.accessed: dict[str, float] = {}  # last access of hits not yet written to the database
+        self.closed = False
+
+    @staticmethod
+    def make_key(data: bytes | memoryview, variant: str = "") -> str:
+        """Content address of an ID image for the current pipeline version and settings `variant`."""
+        digest = hashlib.sha256(f"{PIPELINE_VERSION}:{variant}".encode() + b"\0")
+        digest.update(data)  # hashed in place, uploads stay zero-copy views
+        return digest.hexdigest()
+
+    def get(self, key: str) -> CachedResult | None:
+        """Return the cached result for `key` and mark it as recently used; database errors count as a miss."""
+        with self.lock:
+            if self.closed:
+                return None
+            try:
+                row = self.connection.execute("SELECT details, card, face FROM ocr_results WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error:
+                self.errors += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.accessed[key] = time.time()
+            self.hits += 1
+        details, card, face = row
+        return CachedResult(json.loads(details), card, face)
+
+    def put(self, key: str, result: CachedResult) -> None:
+        """Store a result, evicting the least recently used entries beyond the size bound; dropped on database errors."""
+        details = json.dumps(result.details)
+        size = len(details) + len(result.card or b"") + len(result.face or b"")
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self._flush_accessed()
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO ocr_results (key, details, card, face, size, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, details, result.card, result.face, size, time.time()),
+                )
+                self._evict()
+                self.connection.commit()
+            except sqlite3.Error:
+                self.errors += 1
+                self.connection.rollback()
+
+    def _flush_accessed(self) -> None:
+        accessed, self.accessed = self.accessed, {}
+        self.connection.executemany("UPDATE ocr_results SET last_access = ? WHERE key = ?", [(at, key) for key, at in accessed.items()])
+
+    def _evict(self) -> None:
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.connection.execute("SELECT key, size FROM ocr_results ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM ocr_results WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> dict[str, int]:
+        """Hit/miss/eviction/error counters and the current number of entries (-1 if it could not be read)."""
+        with self.lock:
+            try:
+                entries = 0 if self.closed else self.connection.execute("SELECT COUNT(*) FROM ocr_results").fetchone()[0]
+            except sqlite3.Error:
+                entries = -1
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "errors": self.errors, "entries": entries}
+
+    def close(self) -> None:
+        """Write the pending access times and close the database connection."""
+        with self.lock:
+            self.closed = True
+            with contextlib.suppress(sqlite3.Error):
+                self._flush_accessed()
+                self.connection.commit()
+            self.connection.close()
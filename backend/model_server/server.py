@@ -1,167 +1,683 @@
 """Model Server/Deployment."""
 
 import asyncio
+import base64
+import functools
+import sqlite3
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
 import cv2
 import mediapipe as mp
+import numpy as np
 import ray
 from ray import serve
+from ray.serve import metrics
+from ray.util.scheduling_strategies import NodeAffinitySchedulingStrategy
 from requests import Request
-from skimage.metrics import structural_similarity as ssim
-
-from backend.model_server.img_processing import FaceProcessor, ImageProcessor
+from rich.console import Console
+
+from backend.model_server.cpu_threads import configure_cpu_threads
+from backend.model_server.deadline import Deadline, DeadlineExceededError, WastedWork, await_within
+from backend.model_server.face_detection import build_face_detector
+from backend.model_server.face_similarity import DEFAULT_CHUNK_SIZE, FaceSimilarity
+from backend.model_server.img_processing import DEFAULT_MAX_IMAGE_SIDE, DEFAULT_TARGET_TEXT_HEIGHT, ArtifactWriter, FaceProcessor, ImageProcessor
+from backend.model_server.reference_faces import DEFAULT_MAX_REFERENCE_FACES, ReferenceFaceCache
+from backend.model_server.result_cache import CachedResult, OCRResultCache
+from backend.model_server.uploads import read_upload, spooled_upload, write_atomic
+from backend.model_server.video_processing import (
+    DEFAULT_DECODE_QUEUE_SIZE,
+    DEFAULT_INFERENCE_WIDTH,
+    DEFAULT_SEGMENT_WARMUP_FRAMES,
+    HANDS_OPTIONS,
+    AdaptiveFrameSampler,
+    FramePreparer,
+    FrameReader,
+    HandsPool,
+    SegmentResult,
+    SegmentSettings,
+    StreamingOTPSession,
+    count_fingers,
+    encode_timeline,
+    expand_timeline,
+    merge_timelines,
+    process_video_segment,
+    split_segments,
+    video_frame_count,
+)
+from backend.otp_validation import DEFAULT_HYSTERESIS, DEFAULT_MIN_HOLD, OTPMatcher, is_otp_code, is_valid_otp_timeline
 
 user_dir = Path.cwd() / "user_data"
-
-# Initialize Ray Serve
-ray.init(ignore_reinit_error=True)
-serve.start()
+console = Console()
 
 MIN_SIMILARITY_SCORE = 0.1
+DEFAULT_MAX_BATCH_SIZE = 4
+DEFAULT_BATCH_WAIT_TIMEOUT_S = 0.05
+DEFAULT_CACHE_PATH = Path.cwd() / ".model_cache" / "ocr_results.sqlite"
+DEFAULT_CACHE_MAX_MB = 256
+VIDEO_MAX_ONGOING_REQUESTS = 4
+HANDS_POOL_WAIT_BOUNDARIES_MS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+FACE_DETECTION_BOUNDARIES_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000]
+RESPONSE_FORMATS = ("rle", "frames")
+DEFAULT_SEGMENT_NUM_CPUS = 0.5
+STREAM_MAX_SESSIONS = 16
+SEGMENT_POLL_INTERVAL_S = 0.1  # how often parallel segment tasks are checked against the request deadline
+
+def with_upload_artifacts(result: dict | tuple, artifacts: CachedResult) -> dict | tuple:
+    """Add the JPEG encoded face crop and rotated card to a details result; results without a face are returned unchanged."""
+    if artifacts.face is None or not isinstance(result, dict):
+        return result
+    encoded = {"reference_face_b64": base64.b64encode(artifacts.face).decode()}
+    if artifacts.card is not None:
+        encoded["processed_card_b64"] = base64.b64encode(artifacts.card).decode()
+    return {**result, **encoded}
+
+class FaceDetectionMetric:
+    """Ray Serve histogram of face detector call durations, tagged with the detector backend."""
+
+    def __init__(self) -> None:
+        """Create the metric; must run inside a replica."""
+        self.histogram = metrics.Histogram(
+            "face_detection_ms",
+            description="Duration of a face detector call.",
+            boundaries=FACE_DETECTION_BOUNDARIES_MS,
+            tag_keys=("backend",),
+        )
+
+    def observe(self, backend: str, elapsed_ms: float) -> None:
+        """Record one detector call."""
+        self.histogram.observe(elapsed_ms, tags={"backend": backend})
+
+def requested_otp(data: dict) -> str | None:
+    """Return the OTP a verify request expects, or None in other modes; raises RuntimeError if it is not 4 digits."""
+    if data.get("mode") != "verify":
+        return None
+    otp = data.get("otp")
+    if not is_otp_code(otp):
+        msg = "Verify requests need an `otp` of exactly 4 digits"
+        raise RuntimeError(msg)
+    return otp
 
 @serve.deployment
 class IDOCRProcessor:
-    """Ray Serve Deployment to process ID images."""
+    """Ray Serve Deployment to process ID images.
+
+    Requests can optionally be grouped by Ray Serve batching (see `user_config` in ray_config.yaml),
+    in which case the OCR for concurrent uploads runs as one batched EasyOCR call per rotation round.
+    The ID image is decoded once and passed between stages in memory; the rotated card and face crop
+    are written before the response, the cache entry in the background, and the intermediate images only when `debug_artifacts` is on.
+    Results are cached on the content of `id_proof.jpg`, so re-uploads of the same image skip EasyOCR.
+    Requests carry a `timeout_s` budget; an image whose request timed out or was cancelled leaves the rotation
+    rounds, and the request returns right away instead of waiting for the running round.
+    Requests with an uploaded `image` (see uploads.py) are processed from those bytes instead of `id_proof.jpg`.
+    Their artifacts are not written by the replica, whose disk the caller may not share: the extracted face is returned
+    as `reference_face_b64` (passed on to the video deployment) and the rotated card as `processed_card_b64`.
+    """
 
     def __init__(self) -> None:
         """Preload Models."""
-        self.image_processor = ImageProcessor()
-        self.face_processor = FaceProcessor()
+        self.cpu_threads = configure_cpu_threads()  # before EasyOCR starts its torch thread pools
+        self.artifact_writer = ArtifactWriter()
+        self.image_processor = ImageProcessor(self.artifact_writer)
+        self.face_detection_metric = FaceDetectionMetric()
+        self.face_processor = FaceProcessor(build_face_detector(None, self.face_detection_metric.observe))
+        self.batching = False
+        self.debug_artifacts = False
+        self.result_cache: OCRResultCache | None = None
+        self.wasted_work = WastedWork()
+
+    def reconfigure(self, config: dict) -> None:
+        """Apply the deployment `user_config` (CPU threads, batching, debug artifacts, resolution, face detector and result cache settings)."""
+        self.cpu_threads = configure_cpu_threads(int(config.get("cpu_threads", 0)))
+        console.print(f"[cyan]CPU threads per library:[/cyan] {self.cpu_threads}")
+        self.batching = bool(config.get("batching", False))
+        self.debug_artifacts = bool(config.get("debug_artifacts", False))
+        self.image_processor.max_image_side = int(config.get("max_image_side", DEFAULT_MAX_IMAGE_SIDE))
+        self.image_processor.target_text_height = int(config.get("target_text_height", DEFAULT_TARGET_TEXT_HEIGHT))
+        self.face_processor.face_detector = build_face_detector(config.get("face_detector"), self.face_detection_metric.observe)
+        old_cache, self.result_cache = self.result_cache, None
+        if config.get("cache_enabled", True):
+            cache_path = Path(config.get("cache_path", DEFAULT_CACHE_PATH))
+            try:
+                self.result_cache = OCRResultCache(cache_path, int(config.get("cache_max_mb", DEFAULT_CACHE_MAX_MB)) * 1024 * 1024)
+            except sqlite3.Error as e:
+                console.print(f"[red]⚠️ OCR result cache unavailable, running without it:[/red] {e!s}")
+        if old_cache is not None:
+            # Closed on the writer thread once the inserts already queued for it are done
+            self.artifact_writer.submit(old_cache.close)
+        self.batched_id_ocr.set_max_batch_size(int(config.get("max_batch_size", DEFAULT_MAX_BATCH_SIZE)))
+        self.batched_id_ocr.set_batch_wait_timeout_s(float(config.get("batch_wait_timeout_s", DEFAULT_BATCH_WAIT_TIMEOUT_S)))
 
     async def __call__(self, request: Request) -> dict[str, str | None]:
         """Handle incoming requests for ID OCR processing."""
+        return await self.process(await request.json())
+
+    async def process(self, data: dict) -> dict[str, str | None]:
+        """Process a `{"uid": ...}` request; the entry point for deployment handle calls."""
+        deadline = Deadline.from_request(data)
         try:
-            data = await request.json()
             uid = Path(data.get("uid", ""))
-            loop = asyncio.get_event_loop()
-            extracted_text = await loop.run_in_executor(None, self.id_ocr, uid)
+            upload = await read_upload(data, "image")
+            if self.batching:
+                extracted_text = await await_within(deadline, self.wasted_work, lambda: self.batched_id_ocr(uid, deadline, upload))
+            else:
+                loop = asyncio.get_event_loop()
+                extracted_text = await await_within(deadline, self.wasted_work, lambda: loop.run_in_executor(None, self.id_ocr, uid, deadline, upload))
         except RuntimeError as e:
+            if deadline.reason is not None:
+                console.print(f"[yellow]Abandoned OCR requests:[/yellow] {self.wasted_work.totals}")
             return {"error": f"Failed to process request: {e!s}"}
         else:
             return extracted_text
 
-    def id_ocr(self, uid: Path) -> tuple[str, Path | None]:
-        """Process ID Card, extract OCR text, and save the facial image."""
-        # Perform OCR
-        doc_path = user_dir /uid / "id_proof.jpg"
-        extracted_text, processed_image_path = self.image_processor.perform_ocr(doc_path)
-
-        # Extract Face
-        face_save_path = user_dir / uid / "Extracted_ID_Face.jpg"
-        id_face = self.face_processor.extract_face(processed_image_path, face_save_path)
-
-        if id_face is None:
-            return extracted_text, None
-
-        return extracted_text
+    @serve.batch(max_batch_size=DEFAULT_MAX_BATCH_SIZE, batch_wait_timeout_s=DEFAULT_BATCH_WAIT_TIMEOUT_S)
+    async def batched_id_ocr(self, uids: list[Path], deadlines: list[Deadline], uploads: list[memoryview | None]) -> list[tuple[str, Path | None]]:
+        """Process the uids collected by Ray Serve batching; results are returned in request order."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.id_ocr_batch, uids, deadlines, uploads)
 
-
-@serve.deployment
+    def id_ocr(self, uid: Path, deadline: Deadline | None = None, upload: memoryview | None = None) -> tuple[str, Path | None]:
+        """Process ID Card, extract OCR text, and save the facial image."""
+        return self.id_ocr_batch([uid], None if deadline is None else [deadline], [upload])[0]
+
+    def load_id_proof(self, uid: Path) -> bytes | None:
+        """Read the uploaded ID image bytes, if present."""
+        doc_path = user_dir / uid / "id_proof.jpg"
+        return doc_path.read_bytes() if doc_path.is_file() else None
+
+    def id_ocr_batch(
+        self,
+        uids: list[Path],
+        deadlines: list[Deadline] | None = None,
+        uploads: list[memoryview | None] | None = None,
+    ) -> list[tuple[str, Path | None]]:
+        """Process several ID Cards with batched OCR, then extract and save each facial image.
+
+        Requests whose deadline passed get an `{"error": ...}` result and skip the stages not yet run.
+        Uploaded images are used instead of the user's `id_proof.jpg`, and their results carry the face crop and rotated card.
+        """
+        uploads = uploads or [None] * len(uids)
+        result_cache = self.result_cache  # stays the same for the whole batch if `reconfigure` swaps it
+        raw_images = [self.load_id_proof(uid) if upload is None else upload for uid, upload in zip(uids, uploads, strict=True)]
+        variant = f"{self.image_processor.max_image_side}:{self.image_processor.target_text_height}:{self.face_processor.face_detector.variant()}"
+        cache_keys = [OCRResultCache.make_key(data, variant) if data and result_cache is not None else None for data in raw_images]
+
+        results: list = [None] * len(uids)
+        for i, (uid, cache_key) in enumerate(zip(uids, cache_keys, strict=True)):
+            cached = result_cache.get(cache_key) if cache_key is not None else None
+            if cached is not None:
+                results[i] = self.restore_cached_result(uid, cached, write=uploads[i] is None)
+                if uploads[i] is not None:
+                    results[i] = with_upload_artifacts(results[i], cached)
+        if result_cache is not None:
+            console.print(f"[cyan]OCR cache:[/cyan] {result_cache.stats()}")
+
+        # Perform OCR on the images that were not cached
+        misses = [i for i, result in enumerate(results) if result is None]
+        images = [self.image_processor.decode_image(raw_images[i]) for i in misses]
+        debug_dirs = [user_dir / uids[i] for i in misses] if self.debug_artifacts else None
+        miss_deadlines = [deadlines[i] for i in misses] if deadlines is not None else None
+        ocr_results = self.image_processor.perform_ocr_batch(images, debug_dirs, miss_deadlines)
+
+        for i, (extracted_text, best_rotated_image) in zip(misses, ocr_results, strict=True):
+            if deadlines is not None and deadlines[i].reason is not None:
+                results[i] = {"error": f"Failed to process request: {extracted_text}"}
+                continue
+            if best_rotated_image is None:
+                results[i] = (extracted_text, None)
+                continue
+
+            # Extract Face
+            id_face = self.face_processor.extract_face(best_rotated_image)
+            result = self.encode_result(extracted_text, best_rotated_image, id_face)
+            if cache_keys[i] is not None and result_cache is not None:
+                self.artifact_writer.submit(result_cache.put, cache_keys[i], result)
+            results[i] = (extracted_text, None) if id_face is None else extracted_text
+            if uploads[i] is None:
+                self.write_user_artifacts(uids[i], result)
+            else:
+                results[i] = with_upload_artifacts(results[i], result)
+
+        return results
+
+    def encode_result(self, details: dict | str, card: np.ndarray, face: np.ndarray | None) -> CachedResult:
+        """JPEG encode the rotated card and face crop of a processed ID image."""
+        return CachedResult(details, self.artifact_writer.encode(card), None if face is None else self.artifact_writer.encode(face))
+
+    def write_user_artifacts(self, uid: Path, result: CachedResult) -> None:
+        """Write the encoded rotated card and face crop into the user's folder.
+
+        Written before the response is sent, since the frontend and the reference face warm-up read them right away;
+        each file is replaced atomically so a concurrent reader never sees a truncated JPEG.
+        """
+        if result.card is not None:
+            write_atomic(user_dir / uid / "Processed_ID_Card_Best_angle.jpg", result.card)
+        if result.face is not None:
+            write_atomic(user_dir / uid / "Extracted_ID_Face.jpg", result.face)
+
+    def restore_cached_result(self, uid: Path, cached: CachedResult, *, write: bool = True) -> dict | tuple[dict | str, None]:
+        """Serve a cache hit: the cached artifacts are written for this uid (unless `write` is off), EasyOCR is not touched."""
+        if write:
+            self.write_user_artifacts(uid, cached)
+        return (cached.details, None) if cached.face is None else cached.details
+
+
+@serve.deployment(max_ongoing_requests=VIDEO_MAX_ONGOING_REQUESTS)
 class VideoOTPProcessor:
-    """Ray Serve Deployment to process OTP from video."""
+    """Ray Serve Deployment to process OTP from video.
+
+    Hand inference can run on every `stride`-th frame only (see `hand_sampling` in ray_config.yaml);
+    frames around finger count changes are still inferred so digit changes keep full-rate timing.
+    Frames are decoded on a background thread into a bounded queue, and face checks for the selected
+    frames run on a separate worker while hand inference continues. Hand inference runs on frames downsized to
+    `inference_width`; faces are detected and cropped on the full-resolution frames. The face crops stay in memory and
+    are only written to `face_valid/` when `audit_faces` is on. Reference faces are kept in a per-user
+    LRU cache, which a `{"uid": ..., "mode": "warm"}` request fills ahead of the first login.
+    MediaPipe Hands instances come from a pool sized to the replica's `max_ongoing_requests`.
+    In `{"mode": "verify", "otp": ...}` requests the OTP is matched while decoding, which stops
+    as soon as the OTP has been shown in order.
+    With `parallel_segments.count > 1` a video is split into time segments processed as parallel Ray tasks,
+    whose timelines are merged; verification then happens on the merged timeline.
+    `{"mode": "stream", ...}` requests push chunks of live frames into a per-recording session, keyed by the
+    `serve_multiplexed_model_id` header so that Ray Serve routes the chunks to the replica holding the session;
+    numbered chunks that miss it are rejected, so that the gateway can replay the recording into a new session.
+    Video requests carry a `timeout_s` budget checked on every frame; once it is spent, or the request is cancelled,
+    decoding stops, pending segment tasks are cancelled and the request slot is released.
+    Requests with an uploaded `video` (and the `reference` face returned by IDOCRProcessor) are processed from
+    those bytes, spooled to a replica-local temporary file, instead of the user's folder.
+    """
 
     def __init__(self) -> None:
         """Pre-Loading Models."""
+        self.cpu_threads = configure_cpu_threads()
         self.cv2_module = cv2
         self.mp_module = mp
         ## face detection module/cropping
-        self.face_cascade = self.cv2_module.CascadeClassifier(
-            self.cv2_module.data.haarcascades + "haarcascade_frontalface_default.xml", 
+        self.face_detection_metric = FaceDetectionMetric()
+        self.face_detector = build_face_detector(None, self.face_detection_metric.observe)
+        self.face_similarity = FaceSimilarity(MIN_SIMILARITY_SCORE)
+        self.reference_faces = ReferenceFaceCache()
+        self.hands_pool_wait = metrics.Histogram(
+            "hands_pool_wait_ms",
+            description="Time a video request waited for a free MediaPipe Hands instance.",
+            boundaries=HANDS_POOL_WAIT_BOUNDARIES_MS,
+        )
+        self.hands_pool = self.create_hands_pool(VIDEO_MAX_ONGOING_REQUESTS)
+        self.hand_stride = 1
+        self.hand_densify = True
+        self.decode_queue_size = DEFAULT_DECODE_QUEUE_SIZE
+        self.inference_width = DEFAULT_INFERENCE_WIDTH
+        self.audit_faces = False
+        self.otp_min_hold = DEFAULT_MIN_HOLD
+        self.otp_hysteresis = DEFAULT_HYSTERESIS
+        self.response_format = "rle"
+        self.video_segments = 1
+        self.segment_warmup_frames = DEFAULT_SEGMENT_WARMUP_FRAMES
+        self.segment_task = ray.remote(process_video_segment).options(num_cpus=DEFAULT_SEGMENT_NUM_CPUS)
+        self.face_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="face_check")
+        self.wasted_work = WastedWork()
+
+    def reconfigure(self, config: dict) -> None:
+        """Apply the deployment `user_config`; the options are documented in ray_config.yaml."""
+        self.cpu_threads = configure_cpu_threads(int(config.get("cpu_threads", 0)))
+        console.print(f"[cyan]CPU threads per library:[/cyan] {self.cpu_threads}")
+        self.decode_queue_size = int(config.get("decode_queue_size", DEFAULT_DECODE_QUEUE_SIZE))
+        self.inference_width = int(config.get("inference_width", DEFAULT_INFERENCE_WIDTH))
+        self.audit_faces = bool(config.get("audit_faces", False))
+        response_format = config.get("response_format", "rle")
+        if response_format not in RESPONSE_FORMATS:
+            msg = f"Unknown response format {response_format!r}, expected one of {list(RESPONSE_FORMATS)}"
+            raise ValueError(msg)
+        self.response_format = response_format
+        parallel_segments = config.get("parallel_segments", {})
+        self.video_segments = int(parallel_segments.get("count", 1))
+        self.segment_warmup_frames = int(parallel_segments.get("warmup_frames", DEFAULT_SEGMENT_WARMUP_FRAMES))
+        self.segment_task = ray.remote(process_video_segment).options(num_cpus=float(parallel_segments.get("num_cpus", DEFAULT_SEGMENT_NUM_CPUS)))
+        otp_segmentation = config.get("otp_segmentation", {})
+        self.otp_min_hold = float(otp_segmentation.get("min_hold", DEFAULT_MIN_HOLD))
+        self.otp_hysteresis = float(otp_segmentation.get("hysteresis", DEFAULT_HYSTERESIS))
+        self.reference_faces.max_entries = int(config.get("reference_cache_size", DEFAULT_MAX_REFERENCE_FACES))
+        hands_pool_size = int(config.get("hands_pool_size", VIDEO_MAX_ONGOING_REQUESTS))
+        if hands_pool_size != self.hands_pool.size:
+            old_pool, self.hands_pool = self.hands_pool, self.create_hands_pool(hands_pool_size)
+            old_pool.close()
+        self.face_detector = build_face_detector(config.get("face_detector"), self.face_detection_metric.observe)
+        face_similarity = config.get("face_similarity", {})
+        self.face_similarity = FaceSimilarity(
+            float(face_similarity.get("threshold", MIN_SIMILARITY_SCORE)),
+            face_similarity.get("policy", "all"),
+            int(face_similarity.get("chunk_size", DEFAULT_CHUNK_SIZE)),
         )
-        self.ssim = ssim
+        hand_sampling = config.get("hand_sampling", {})
+        self.hand_stride = int(hand_sampling.get("stride", 1))
+        self.hand_densify = bool(hand_sampling.get("densify", True))
 
-    async def __call__(self, request: Request) -> dict[str, list[int]]:
-        """Handle the incoming request. Overwritten as per problem req."""
+    async def __call__(self, request: Request) -> dict[str, list | dict | int | bool]:
+        """Handle the incoming request. Overwritten as per problem req.
+
+        The digits are returned as a run-length encoded `segments` timeline of `[digit, start_frame, length, mean_confidence]`
+        entries, or as the legacy per-frame `otp` list with `response_format: frames`.
+        """
+        return await self.process(await request.json())
+
+    async def process(self, data: dict) -> dict[str, list | dict | int | bool]:
+        """Process a video, warm or stream request; the entry point for deployment handle calls."""
         try:
-            data = await request.json()
             uid = Path(data.get("uid", ""))
-            video_path = user_dir / uid /  "recorded_videos" / "live_recording.mp4"
             loop = asyncio.get_event_loop()
-            otp_sequence = await loop.run_in_executor(
-                None,
-                self.process_video_and_generate_otp,
-                video_path,
-                uid,
-            )
+            if data.get("mode") == "warm":
+                reference = await read_upload(data, "reference")
+                return {"warmed": await loop.run_in_executor(None, self.warm_reference_face, uid, reference)}
+            if data.get("mode") == "stream":
+                return await self.stream_chunk(uid, data)
+            video_path = user_dir / uid /  "recorded_videos" / "live_recording.mp4"
+            expected_otp = requested_otp(data)
+            deadline = Deadline.from_request(data)
+            video = await read_upload(data, "video")
+            reference = await read_upload(data, "reference")
+            if video is None:
+                run = functools.partial(self.process_video_and_generate_otp, video_path, uid, expected_otp, deadline, reference)
+            else:
+                run = functools.partial(self.process_uploaded_video, video, uid, expected_otp, deadline, reference)
+            timeline, frame_stats = await await_within(deadline, self.wasted_work, lambda: loop.run_in_executor(None, run))
+        except DeadlineExceededError as e:
+            console.print(f"[yellow]Abandoned video requests:[/yellow] {self.wasted_work.totals}")
+            return {"error": f"Failed to process request: {e!s}"}
         except RuntimeError as e:
             return {"error": f"Failed to process request: {e!s}"}
         else:
-            return {"otp": otp_sequence}
-
-    def compare_faces(self, uid: Path, webcam_image_path: Path) -> bool:
-        """Compare already extracted face images using ORB feature matching."""
-        # Load images in grayscale
-        id_face = self.cv2_module.imread(str(user_dir / uid /"Extracted_ID_Face.jpg"), self.cv2_module.IMREAD_GRAYSCALE)
-        webcam_face = self.cv2_module.imread(str(webcam_image_path), self.cv2_module.IMREAD_GRAYSCALE)
-
-        # Compute SSIM similarity score
-        similarity_score, _ = self.ssim(id_face, webcam_face, full=True)
-
-        return similarity_score >= MIN_SIMILARITY_SCORE
-
+            if self.response_format == "frames":
+                return {"otp": expand_timeline(timeline), **frame_stats}
+            return {"segments": timeline, **frame_stats}
+
+    def create_hands_pool(self, size: int) -> HandsPool:
+        """Create `size` warmed MediaPipe Hands instances."""
+        return HandsPool(
+            size,
+            lambda: self.mp_module.solutions.hands.Hands(**HANDS_OPTIONS),
+            self.hands_pool_wait.observe,
+        )
 
-    def process_video_and_generate_otp(self, video_path: str, uid: Path) -> list[int]:
-        """Process Video and generate OTP."""
-        mp_hands = self.mp_module.solutions.hands
-        cap = self.cv2_module.VideoCapture(video_path)
-        sequence_generated = []
-        finger_tips = [4, 8, 12, 16, 20]
+    def reference_face(self, uid: Path, reference: memoryview | None = None) -> np.ndarray | None:
+        """Return the user's grayscale reference face from the per-user cache, decoded from `reference` if it was sent."""
+        if reference is not None:
+            return self.reference_faces.get_encoded(str(uid), reference)
+        return self.reference_faces.get(str(uid), user_dir / uid / "Extracted_ID_Face.jpg")
+
+    def warm_reference_face(self, uid: Path, reference: memoryview | None = None) -> bool:
+        """Load the user's reference face into the cache, e.g. right after registration."""
+        warmed = self.reference_face(uid, reference) is not None
+        console.print(f"[cyan]Reference face cache:[/cyan] {self.reference_faces.stats()}")
+        return warmed
+
+    def compare_faces(self, uid: Path, webcam_faces: list[np.ndarray], reference: memoryview | None = None) -> bool:
+        """Compare the stacked webcam face crops against the extracted ID face with batched SSIM and the configured policy."""
+        if not webcam_faces:
+            return True
+        id_face = self.reference_face(uid, reference)
+        if id_face is None:
+            console.print(f"[red]⚠️ No extracted ID face for:[/red] {uid}")
+            return False
+
+        candidates = np.stack([self.cv2_module.cvtColor(webcam_face, self.cv2_module.COLOR_BGR2GRAY) for webcam_face in webcam_faces])
+        match = self.face_similarity.compare(id_face, candidates)
+        console.print(
+            f"[cyan]Face similarity scores ({match.policy}):[/cyan] {[round(score, 3) for score in match.scores]} "
+            f"({match.evaluated}/{len(webcam_faces)} crops scored)",
+        )
+        return match.passed
+
+    def extract_face_crop(self, frame: np.ndarray, audit_path: Path | None = None) -> np.ndarray | None:
+        """Detect the largest face in a frame and return a 200x200 crop of it, also saved to `audit_path` if given."""
+        faces, detect_ms = self.face_detector.detect_timed(frame)
+        console.print(f"[cyan]Face detection ({self.face_detector.name}):[/cyan] {detect_ms:.1f} ms")
+
+        if len(faces) == 0:
+            return None
+        offset = 50 # to ensure face isnt cutoff
+        x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+        face = frame[max(y - offset, 0) : min(y + h + offset, frame.shape[0]), max(x - offset, 0) : min(x + w + offset, frame.shape[1])]
+        face_resized = self.cv2_module.resize(face, (200, 200))
+        if audit_path is not None:
+            audit_path.parent.mkdir(parents=True, exist_ok=True)
+            self.cv2_module.imwrite(str(audit_path), face_resized)
+        return face_resized
+
+    def process_video_and_generate_otp(
+        self,
+        video_path: Path,
+        uid: Path,
+        expected_otp: str | None = None,
+        deadline: Deadline | None = None,
+        reference: memoryview | None = None,
+    ) -> tuple[list[list[int | float]], dict]:
+        """Process Video and generate the run-length encoded OTP timeline, along with frame counts and stage timings.
+
+        With `expected_otp` (verify mode) the verdict is returned as `verified`. Serial processing matches the digits
+        while decoding and stops as soon as the OTP has been shown in order; otherwise the whole video is read.
+        Raises `DeadlineExceededError` once `deadline` is spent or cancelled.
+        Faces are compared against the JPEG encoded `reference` face if given, else the user's extracted ID face.
+        """
+        deadline = deadline or Deadline()
+        start = time.perf_counter()
+        segments = split_segments(video_frame_count(video_path), self.video_segments) if self.video_segments > 1 else []
+        matcher = OTPMatcher(expected_otp, self.otp_min_hold, self.otp_hysteresis) if expected_otp and len(segments) <= 1 else None
+        if len(segments) > 1:
+            timeline, face_jobs, frame_stats = self.infer_segments(video_path, uid, segments, deadline)
+        else:
+            timeline, face_jobs, frame_stats = self.infer_serially(video_path, uid, matcher, deadline)
+        frames_done = time.perf_counter()
+        deadline.check("face check")
+
+        webcam_faces = [face for face in (face_job.result() for face_job in face_jobs) if face is not None]
+        console.print(f"[cyan]Hand inference:[/cyan] {frame_stats['frames_inferred']}/{frame_stats['frames_total']} frames (stride {self.hand_stride})")
+        flag = self.compare_faces(uid, webcam_faces, reference)
+        end = time.perf_counter()
+        frame_stats["timings_ms"] = {
+            "frames": round((frames_done - start) * 1000, 1),
+            "faces": round((end - frames_done) * 1000, 1),
+            "total": round((end - start) * 1000, 1),
+        }
+        console.print(f"[cyan]Frame buffer allocations:[/cyan] {frame_stats['buffer_allocations']} for {frame_stats['frames_total']} frames")
+
+        if expected_otp:
+            sequence_matched = self.match_otp(timeline, matcher, expected_otp)
+            frame_stats["verified"] = flag and sequence_matched
+            console.print(f"[cyan]OTP verification:[/cyan] {'matched' if sequence_matched else 'failed'} after {frame_stats['frames_total']} frames")
+
+        return (timeline if flag else []), frame_stats
+
+    def process_uploaded_video(
+        self,
+        video: memoryview,
+        uid: Path,
+        expected_otp: str | None,
+        deadline: Deadline,
+        reference: memoryview | None,
+    ) -> tuple[list[list[int | float]], dict]:
+        """Spool an uploaded video to a replica-local temporary file (OpenCV decodes from paths) and process it."""
+        with spooled_upload(video, ".mp4") as video_path:
+            return self.process_video_and_generate_otp(video_path, uid, expected_otp, deadline, reference)
+
+    def match_otp(self, timeline: list[list[int | float]], matcher: OTPMatcher | None, expected_otp: str) -> bool:
+        """Use the matcher's verdict if it matched early, otherwise validate the whole timeline (the matcher never fails early)."""
+        if matcher is not None and matcher.done:
+            return matcher.status == OTPMatcher.MATCHED
+        return is_valid_otp_timeline(timeline, list(expected_otp), min_hold=self.otp_min_hold, hysteresis=self.otp_hysteresis)
+
+    @serve.multiplexed(max_num_models_per_replica=STREAM_MAX_SESSIONS)
+    async def get_stream_session(self, session_id: str) -> StreamingOTPSession:
+        """Open the streaming session `session_id` with its own MediaPipe Hands instance."""
+        console.print(f"[cyan]Opening OTP stream session:[/cyan] {session_id}")
+        hands = await asyncio.to_thread(self.mp_module.solutions.hands.Hands, **HANDS_OPTIONS)
+        return StreamingOTPSession(hands, self.hand_stride, densify=self.hand_densify, inference_width=self.inference_width)
+
+    async def stream_chunk(self, uid: Path, data: dict) -> dict:
+        """Push a chunk of base64 encoded frames into the request's streaming session; the `final` chunk returns the verdict.
+
+        Chunks carry a sequence number `seq` starting at 0. Multiplexed routing is best effort, so a chunk can reach a
+        replica that never held the session or has evicted it; a chunk that does not continue its session is rejected
+        with `session_lost`, and the gateway replays the recording into a new session instead of getting a verdict on
+        a partial timeline. The first chunk can carry the user's `reference` face (see uploads.py), which is kept
+        for the session's face check instead of reading it from the user's folder.
+        """
+        session_id = serve.get_multiplexed_model_id()
+        if not session_id:
+            return {"error": "Streaming requests need a serve_multiplexed_model_id header"}
+        expected_otp = data.get("otp")
+        if not is_otp_code(expected_otp):
+            return {"error": "Streaming requests need an `otp` of exactly 4 digits"}
+        session = await self.get_stream_session(session_id)
+        seq = int(data.get("seq", 0))
+        if seq != session.chunks_received or session.closed:
+            console.print(f"[yellow]OTP stream session {session_id} lost:[/yellow] got chunk {seq}, expected {session.chunks_received}")
+            session.close()
+            return {"error": f"Chunk {seq} does not continue stream session {session_id}", "session_lost": True}
+        session.chunks_received += 1
+        if session.matcher is None:
+            session.start(OTPMatcher(expected_otp, self.otp_min_hold, self.otp_hysteresis), int(data.get("expected_frames", 0)), await read_upload(data, "reference"))
+        frames = [base64.b64decode(frame) for frame in data.get("frames", [])]
+        await asyncio.to_thread(lambda: [session.push_encoded(frame) for frame in frames])
+        if not data.get("final"):
+            return {"status": session.matcher.status, "frames_received": session.frames_received}
+        return await asyncio.to_thread(self.finish_stream, uid, session, expected_otp)
+
+    def finish_stream(self, uid: Path, session: StreamingOTPSession, expected_otp: str) -> dict:
+        """Close a streaming session, run the face check on its kept frames and return the verdict.
+
+        Ray Serve cannot drop a single multiplexed session, so `finish` releases the session's Hands instance and frame
+        buffers here; only an empty, closed placeholder stays in the replica's session LRU.
+        """
+        reference = session.reference
+        timeline, face_frames = session.finish()
+        faces_start = time.perf_counter()
         face_valid_path = user_dir / uid / "face_valid"
-        face_valid_path.mkdir(parents=True, exist_ok=True)
+        webcam_faces = [
+            face
+            for frame_index, frame in sorted(face_frames.items())
+            if (face := self.extract_face_crop(frame, face_valid_path / f"face_{frame_index}.jpg" if self.audit_faces else None)) is not None
+        ]
+        flag = self.compare_faces(uid, webcam_faces, reference)
+        sequence_matched = self.match_otp(timeline, session.matcher, expected_otp)
+        end = time.perf_counter()
+        console.print(f"[cyan]OTP stream verification:[/cyan] {'matched' if sequence_matched else 'failed'} after {session.frames_received} frames")
+        return {
+            "segments": timeline if flag else [],
+            "frames_total": session.frames_received,
+            "frames_inferred": session.sampler.frames_inferred,
+            "stopped_early": session.done,
+            "buffer_allocations": session.preparer.allocations,
+            "verified": flag and sequence_matched,
+            "timings_ms": {"faces": round((end - faces_start) * 1000, 1), "session": round((end - session.started) * 1000, 1)},
+        }
+
+    def infer_serially(self, video_path: Path, uid: Path, matcher: OTPMatcher | None, deadline: Deadline) -> tuple[list[list[int | float]], list[Future], dict]:
+        """Run hand inference over the whole video in this replica, feeding `matcher` and stopping once it is decided."""
+        face_valid_path = user_dir / uid / "face_valid"
+        face_jobs = []
+        matched_frames = 0
+
+        preparer = FramePreparer(self.inference_width, self.hand_stride + 1)  # the sampler holds up to `stride` frames
 
-        with mp_hands.Hands(min_detection_confidence=0.5, min_tracking_confidence=0.5, max_num_hands=2) as hands:
-            frame_index = 0
-            total_frames = int(cap.get(self.cv2_module.CAP_PROP_FRAME_COUNT)) #vid len
+        with FrameReader(video_path, self.decode_queue_size) as reader, self.hands_pool.checkout() as hands:
+            sampler = AdaptiveFrameSampler(
+                lambda frame: count_fingers(hands.process(preparer.to_rgb(frame))),
+                self.hand_stride,
+                densify=self.hand_densify,
+                reset=hands.reset,
+            )
+            total_frames = reader.total_frames #vid len
             selected_frames = [0, total_frames // 2, total_frames - 1] # [st,mid,last] frames...for face extraction
 
-            while cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
-                    break
-
-                if frame_index in selected_frames:
-                    gray = self.cv2_module.cvtColor(frame, self.cv2_module.COLOR_BGR2GRAY)
-                    faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(50, 50))
-
-                    if faces is not None and len(faces) > 0:
-                        offset = 50 # to ensure face isnt cutoff
-                        x, y, w, h = sorted(faces, key=lambda f: f[2] * f[3], reverse=True)[0]
-                        face = frame[max(y - offset, 0) : min(y + h + offset, frame.shape[0]), max(x - offset, 0) : min(x + w + offset, frame.shape[1])]
-                        face_resized = self.cv2_module.resize(face, (200, 200))
-                        self.cv2_module.imwrite(str(face_valid_path / f"face_{frame_index}.jpg"), face_resized)
-
-                rgb_frame = self.cv2_module.cvtColor(frame, self.cv2_module.COLOR_BGR2RGB)
-                results = hands.process(rgb_frame)
-
-                total_fingers = 0
-                if results.multi_hand_landmarks:
-                    for hand, handedness in zip(results.multi_hand_landmarks, results.multi_handedness, strict=False):
-                        hand_label = handedness.classification[0].label  # 'Left' or 'Right'
-                        # thumb wasnt being detected explicitly in all scenarios
-                        thumb_up = hand.landmark[4].x < hand.landmark[2].x if hand_label == "Right" else hand.landmark[4].x > hand.landmark[2].x 
-
-                        # other fingers
-                        fingers_up = sum(
-                            1 if hand.landmark[tip].y < hand.landmark[tip - 1].y else 0
-                            for tip in finger_tips[1:]  # exclude thumb
-                        )
-
-                        total_fingers += fingers_up + (1 if thumb_up else 0)
-
-                sequence_generated.append(min(max(total_fingers, 0), 9))
-                frame_index += 1
-        image_extensions = (".jpg", ".jpeg", ".png")
-        flag=True
-        for image_path in face_valid_path.iterdir():
-            if image_path.suffix.lower() in image_extensions and image_path.is_file():
-                flag = flag & self.compare_faces(uid,image_path)
-
-        cap.release()
-        return sequence_generated if flag else []
+            for frame_index, decoded in reader:
+                deadline.check("frame decoding")
+                sampler.push(preparer.prepare(decoded))
+                if matcher is not None:
+                    for digit, confidence in zip(sampler.sequence[matched_frames:], sampler.confidences[matched_frames:], strict=True):
+                        matcher.push(digit, confidence)
+                    matched_frames = len(sampler.sequence)
+                if frame_index in selected_frames or (matcher is not None and matcher.done):
+                    audit_path = face_valid_path / f"face_{frame_index}.jpg" if self.audit_faces else None
+                    # faces are cropped from the full-resolution frame, decoded frames are not reused
+                    face_jobs.append(self.face_executor.submit(self.extract_face_crop, decoded, audit_path))
+                if matcher is not None and matcher.done:
+                    break  # the stop frame stands in for the last frame's face check
+            sampler.flush()
+
+        frame_stats = {
+            "frames_total": reader.frames_read,
+            "frames_inferred": sampler.frames_inferred,
+            "stopped_early": matcher is not None and matcher.done,
+            "buffer_allocations": preparer.allocations,
+        }
+        return encode_timeline(sampler.sequence, sampler.confidences), face_jobs, frame_stats
+
+    def infer_segments(
+        self,
+        video_path: Path,
+        uid: Path,
+        segments: list[tuple[int, int]],
+        deadline: Deadline,
+    ) -> tuple[list[list[int | float]], list[Future], dict]:
+        """Run hand inference on each `(start, stop)` frame range as a parallel Ray task and merge the timelines.
+
+        Segments rely on the container's frame count and on exact seeks. The last segment stops at the reported frame
+        count, like the `video_frame_count` the segments were planned from. If a segment read fewer frames than planned,
+        or its seek landed elsewhere, frames are missing and the video is processed serially instead.
+        """
+        face_valid_path = user_dir / uid / "face_valid"
+        total_frames = segments[-1][1]
+        selected_frames = frozenset([0, total_frames // 2, total_frames - 1])
+        settings = SegmentSettings(self.segment_warmup_frames, self.hand_stride, self.hand_densify, self.decode_queue_size, self.inference_width)
+        # Pinned to this node, since the video is read from its local disk (uploads are spooled to a temporary file)
+        segment_task = self.segment_task.options(scheduling_strategy=NodeAffinitySchedulingStrategy(ray.get_runtime_context().get_node_id(), soft=False))
+        refs = [segment_task.remote(str(video_path), segment, settings, selected_frames) for segment in segments]
+        pending = refs
+        while pending:
+            _, pending = ray.wait(pending, num_returns=len(pending), timeout=SEGMENT_POLL_INTERVAL_S)
+            if pending and deadline.reason is not None:
+                for ref in pending:
+                    ray.cancel(ref)
+                deadline.check("parallel segments")
+        results = ray.get(refs)
+        misaligned = [segment for segment, result in zip(segments, results, strict=True) if not self.segment_aligned(segment, result)]
+        if misaligned:
+            console.print(f"[yellow]Inexact frame count or seek in {len(misaligned)}/{len(segments)} segments, processing serially:[/yellow] {video_path}")
+            timeline, face_jobs, frame_stats = self.infer_serially(video_path, uid, None, deadline)
+            frame_stats["frames_inferred"] += sum(result.frames_inferred for result in results)
+            frame_stats["buffer_allocations"] += sum(result.buffer_allocations for result in results)
+            frame_stats["segments_fallback"] = True
+            return timeline, face_jobs, frame_stats
+        face_jobs = [
+            self.face_executor.submit(self.extract_face_crop, frame, face_valid_path / f"face_{frame_index}.jpg" if self.audit_faces else None)
+            for result in results
+            for frame_index, frame in sorted(result.kept_frames.items())
+        ]
+        frame_stats = {
+            "frames_total": sum(result.frames_read for result in results),
+            "frames_inferred": sum(result.frames_inferred for result in results),
+            "stopped_early": False,
+            "segments_processed": len(results),
+            "buffer_allocations": sum(result.buffer_allocations for result in results),
+        }
+        return merge_timelines([result.timeline for result in results]), face_jobs, frame_stats
+
+    def segment_aligned(self, segment: tuple[int, int], result: SegmentResult) -> bool:
+        """Whether a segment task read all of its planned warm-up and segment frames, starting where it seeked to.
+
+        Segment tasks stop at the end of their range, so reading fewer frames is the only possible mismatch.
+        """
+        start, stop = segment
+        warmup_start = max(0, start - self.segment_warmup_frames)
+        return result.first_frame == warmup_start and result.warmup_read == start - warmup_start and result.frames_read == stop - start
 
 id_processor_app = IDOCRProcessor.bind()
 video_otp_processor_app = VideoOTPProcessor.bind()
 
-serve.run(id_processor_app)
-serve.run(video_otp_processor_app)
+if __name__ == "__main__":
+    # Initialize Ray Serve; `serve run backend/model_server/ray_config.yaml` deploys the same apps with their configs
+    ray.init(ignore_reinit_error=True)
+    serve.start()
+    serve.run(id_processor_app, name="id_ocr_server", route_prefix="/IDOCRProcessor")
+    serve.run(video_otp_processor_app, name="model_server", route_prefix="/VideoOTPProcessor")
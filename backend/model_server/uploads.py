@@ -0,0 +1,54 @@
+"""Uploaded file bytes sent with a request instead of being read from the shared `user_data` folder."""
+
+from __future__ import annotations
+
+import base64
+import contextlib
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+
+async def read_upload(data: dict, name: str) -> memoryview | None:
+    """Return the bytes of upload `name` from a request payload, or None if it has none.
+
+    Deployment handle calls pass `<name>_ref`, an object store reference to a uint8 array, which is read
+    zero-copy from the node's object store. HTTP calls pass the base64 encoded bytes as `<name>_b64`.
+    """
+    ref = data.get(f"{name}_ref")
+    if ref is not None:
+        return memoryview(await ref)
+    encoded = data.get(f"{name}_b64")
+    if encoded is not None:
+        return memoryview(np.frombuffer(base64.b64decode(encoded), dtype=np.uint8))
+    return None
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """Write `data` to `path` through a temporary file in the same folder, so readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.", delete=False) as tmp:
+        tmp.write(data)
+    staged = Path(tmp.name)
+    try:
+        staged.replace(path)
+    except OSError:
+        staged.unlink(missing_ok=True)
+        raise
+
+
+@contextlib.contextmanager
+def spooled_upload(upload: memoryview, suffix: str) -> Iterator[Path]:
+    """Write an upload to a replica-local temporary file for readers that need a path (e.g. `cv2.VideoCapture`), removed afterwards."""
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as spool:
+        spool.write(upload)
+    path = Path(spool.name)
+    try:
+        yield path
+    finally:
+        path.unlink(missing_ok=True)
@@ -0,0 +1,514 @@
+"""Frame-level helpers for the OTP video pipeline."""
+
+from __future__ import annotations
+
+import itertools
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, NamedTuple, Self
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from backend.model_server.cpu_threads import configure_cpu_threads
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+    from pathlib import Path
+
+    from mediapipe.python.solutions.hands import Hands
+
+    from backend.otp_validation import OTPMatcher
+
+FINGER_TIPS = [4, 8, 12, 16, 20]
+MAX_DIGIT = 9
+DEFAULT_DECODE_QUEUE_SIZE = 8
+DEFAULT_SEGMENT_WARMUP_FRAMES = 15
+MIN_SEGMENT_FRAMES = 30
+DEFAULT_INFERENCE_WIDTH = 640
+HANDS_OPTIONS = {"min_detection_confidence": 0.5, "min_tracking_confidence": 0.5, "max_num_hands": 2}
+QUEUE_POLL_INTERVAL_S = 0.1
+_END_OF_VIDEO = object()
+
+
+def count_fingers(results: Any) -> tuple[int, float]:  # noqa: ANN401 - MediaPipe results object
+    """Count the raised fingers over all hands in a MediaPipe Hands result, clamped to a single digit.
+
+    Also returns a confidence: the lowest handedness score among the detected hands (1.0 when there is no hand).
+    """
+    total_fingers = 0
+    confidence = 1.0
+    if results.multi_hand_landmarks:
+        for hand, handedness in zip(results.multi_hand_landmarks, results.multi_handedness, strict=False):
+            hand_label = handedness.classification[0].label  # 'Left' or 'Right'
+            confidence = min(confidence, handedness.classification[0].score)
+            # thumb wasnt being detected explicitly in all scenarios
+            thumb_up = hand.landmark[4].x < hand.landmark[2].x if hand_label == "Right" else hand.landmark[4].x > hand.landmark[2].x
+
+            # other fingers
+            fingers_up = sum(
+                1 if hand.landmark[tip].y < hand.landmark[tip - 1].y else 0
+                for tip in FINGER_TIPS[1:]  # exclude thumb
+            )
+
+            total_fingers += fingers_up + (1 if thumb_up else 0)
+
+    return min(max(total_fingers, 0), MAX_DIGIT), confidence
+
+
+def encode_timeline(sequence: list[int], confidences: list[float]) -> list[list[int | float]]:
+    """Run-length encode per-frame digits as `[digit, start_frame, length, mean_confidence]` segments.
+
+    The confidence of a frame is its MediaPipe handedness score (see `count_fingers`), not a digit confidence;
+    the OTP segmenter uses it as the frame's weight. The mean is kept at full precision, so validating the timeline
+    gives the same result as validating the per-frame digits (up to float rounding of the summed weights).
+    """
+    segments: list[list[int | float]] = []
+    for frame_index, (digit, confidence) in enumerate(zip(sequence, confidences, strict=True)):
+        if segments and segments[-1][0] == digit:
+            segments[-1][2] += 1
+            segments[-1][3] += confidence
+        else:
+            segments.append([digit, frame_index, 1, confidence])
+    for segment in segments:
+        segment[3] /= segment[2]
+    return segments
+
+
+def merge_timelines(timelines: list[list[list[int | float]]]) -> list[list[int | float]]:
+    """Concatenate consecutive run-length encoded timelines, joining runs of the same digit across the boundaries."""
+    merged: list[list[int | float]] = []
+    for timeline in timelines:
+        for digit, start, length, confidence in timeline:
+            if merged and merged[-1][0] == digit and merged[-1][1] + merged[-1][2] == start:
+                previous = merged[-1]
+                previous[3] = (previous[3] * previous[2] + confidence * length) / (previous[2] + length)
+                previous[2] += length
+            else:
+                merged.append([digit, start, length, confidence])
+    return merged
+
+
+def expand_timeline(timeline: list[list[int | float]]) -> list[int]:
+    """Expand a run-length encoded timeline back into per-frame digits."""
+    return [int(digit) for digit, _start, length, _confidence in timeline for _ in range(int(length))]
+
+
+def video_frame_count(video_path: str | Path) -> int:
+    """Read the frame count from the container metadata without decoding any frame."""
+    cap = cv2.VideoCapture(str(video_path))
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        cap.release()
+
+
+def split_segments(total_frames: int, count: int) -> list[tuple[int, int]]:
+    """Split `[0, total_frames)` into at most `count` contiguous `(start, stop)` ranges of at least `MIN_SEGMENT_FRAMES`."""
+    count = max(1, min(count, total_frames // MIN_SEGMENT_FRAMES))
+    bounds = [total_frames * i // count for i in range(count + 1)]
+    return list(itertools.pairwise(bounds))
+
+
+class SegmentSettings(NamedTuple):
+    """Per-task settings of `process_video_segment`."""
+
+    warmup: int = DEFAULT_SEGMENT_WARMUP_FRAMES  # frames decoded before the segment to prime the hand tracker
+    stride: int = 1
+    densify: bool = True
+    decode_queue_size: int = DEFAULT_DECODE_QUEUE_SIZE
+    inference_width: int = DEFAULT_INFERENCE_WIDTH
+
+
+class SegmentResult(NamedTuple):
+    """Output of `process_video_segment`."""
+
+    timeline: list[list[int | float]]  # run-length encoded, absolute frame indices
+    kept_frames: dict[int, np.ndarray]  # requested frames within the segment, for face checks
+    frames_read: int  # excluding warm-up frames
+    frames_inferred: int  # including warm-up frames
+    warmup_read: int
+    first_frame: int  # position the capture reported after seeking to the first warm-up frame
+    buffer_allocations: int  # frame buffers the segment's `FramePreparer` allocated
+
+
+def process_video_segment(video_path: str, segment: tuple[int, int], settings: SegmentSettings, keep_frames: frozenset[int] = frozenset()) -> SegmentResult:
+    """Run hand inference on the frames `[start, stop)` of a video with a dedicated MediaPipe Hands instance.
+
+    Decoding seeks to `settings.warmup` frames before `start`; those frames only prime the hand tracker, so the
+    digits at the start of the segment match what serial processing of the whole video would produce.
+    """
+    start, stop = segment
+    configure_cpu_threads()
+    hands = mp.solutions.hands.Hands(**HANDS_OPTIONS)
+    preparer = FramePreparer(settings.inference_width, settings.stride + 1)
+    kept_frames = {}
+    warmup_read = 0
+    try:
+        with FrameReader(video_path, settings.decode_queue_size, start=max(0, start - settings.warmup), stop=stop) as reader:
+            sampler = AdaptiveFrameSampler(
+                lambda frame: count_fingers(hands.process(preparer.to_rgb(frame))),
+                settings.stride,
+                densify=settings.densify,
+                reset=hands.reset,
+            )
+            first_frame = reader.seek_position
+            for frame_index, decoded in reader:
+                frame = preparer.prepare(decoded)
+                if frame_index < start:
+                    hands.process(preparer.to_rgb(frame))
+                    warmup_read += 1
+                    continue
+                sampler.push(frame)
+                if frame_index in keep_frames:
+                    kept_frames[frame_index] = decoded  # full resolution for the face check
+            sampler.flush()
+    finally:
+        hands.close()
+    timeline = [[digit, first + start, length, confidence] for digit, first, length, confidence in encode_timeline(sampler.sequence, sampler.confidences)]
+    return SegmentResult(timeline, kept_frames, len(sampler.sequence), sampler.frames_inferred + warmup_read, warmup_read, first_frame, preparer.allocations)
+
+
+class FramePreparer:
+    """Downsizes decoded frames to the inference resolution into preallocated, reused buffers.
+
+    - `prepare` resizes into a ring of `slots` BGR buffers, so a frame stays valid until `slots` more
+      frames have been prepared; keep `slots` above the number of frames held at once (e.g. the sampling stride).
+    - `to_rgb` converts into a single RGB buffer that is overwritten by the next call.
+    - Frames already within `max_width` are passed through untouched; `max_width=0` disables downsizing.
+    - `allocations` counts the buffers allocated so far; it stays at most `slots + 1` while the frame size does not change.
+    """
+
+    def __init__(self, max_width: int = DEFAULT_INFERENCE_WIDTH, slots: int = 2) -> None:
+        """Set the inference width and the number of BGR buffers."""
+        self.cv2_module = cv2
+        self.max_width = max_width
+        self.slots: list[np.ndarray | None] = [None] * max(1, slots)
+        self.next_slot = 0
+        self.rgb: np.ndarray | None = None
+        self.allocations = 0
+
+    def prepare(self, frame: np.ndarray) -> np.ndarray:
+        """Return `frame` downsized to at most `max_width`, written into the next ring buffer."""
+        height, width = frame.shape[:2]
+        if not self.max_width or width <= self.max_width:
+            return frame
+        shape = (height * self.max_width // width, self.max_width, *frame.shape[2:])
+        buffer = self.slots[self.next_slot]
+        if buffer is None or buffer.shape != shape:
+            buffer = self.slots[self.next_slot] = self._allocate(shape, frame)
+        self.next_slot = (self.next_slot + 1) % len(self.slots)
+        return self.cv2_module.resize(frame, (shape[1], shape[0]), dst=buffer, interpolation=self.cv2_module.INTER_AREA)
+
+    def to_rgb(self, frame: np.ndarray) -> np.ndarray:
+        """Convert a BGR frame into the shared RGB buffer."""
+        if self.rgb is None or self.rgb.shape != frame.shape:
+            self.rgb = self._allocate(frame.shape, frame)
+        return self.cv2_module.cvtColor(frame, self.cv2_module.COLOR_BGR2RGB, dst=self.rgb)
+
+    def _allocate(self, shape: tuple[int, ...], like: np.ndarray) -> np.ndarray:
+        self.allocations += 1
+        return np.empty(shape, dtype=like.dtype)
+
+
+class AdaptiveFrameSampler:
+    """Runs hand inference every `stride` frames and fills in the frames in between.
+
+    - When two consecutive samples agree, the skipped frames take that value.
+    - When they differ and `densify` is on, the skipped frames are inferred as well, so the point
+      where the finger count changes is located at full frame rate.
+    - The skipped frames are older than the sample that triggered them, so `reset` (e.g. `Hands.reset`) is
+      called first to take a tracking model out of tracking mode; they are then inferred in frame order.
+    - A run shorter than `stride` between two agreeing samples (e.g. a flicker A, B, A) is not seen. Keep
+      `stride` at most the OTP segmenter's `min_hold`, which drops such short runs anyway.
+
+    With `stride=1` every frame is inferred, which is the original behaviour. `infer` returns the digit
+    and its confidence; filled-in frames take the confidence of the sample they copy.
+    """
+
+    def __init__(
+        self,
+        infer: Callable[[np.ndarray], tuple[int, float]],
+        stride: int = 1,
+        *,
+        densify: bool = True,
+        reset: Callable[[], None] | None = None,
+    ) -> None:
+        """Set the per-frame inference function, the sampling policy and the tracker reset."""
+        self.infer = infer
+        self.stride = max(1, stride)
+        self.densify = densify
+        self.reset = reset
+        self.pending: list[np.ndarray] = []  # frames since the last sample
+        self.last_sample: tuple[int, float] | None = None
+        self.sequence: list[int] = []
+        self.confidences: list[float] = []
+        self.frames_inferred = 0
+
+    def push(self, frame: np.ndarray) -> None:
+        """Add the next decoded frame."""
+        if self.last_sample is None or len(self.pending) + 1 >= self.stride:
+            self._sample(frame)
+        else:
+            self.pending.append(frame)
+
+    def flush(self) -> list[int]:
+        """Resolve the frames still buffered at the end of the video and return the per-frame digits."""
+        if self.pending:
+            self._sample(self.pending.pop())
+        return self.sequence
+
+    def _infer(self, frame: np.ndarray) -> tuple[int, float]:
+        self.frames_inferred += 1
+        return self.infer(frame)
+
+    def _sample(self, frame: np.ndarray) -> None:
+        sample = self._infer(frame)
+        if self.last_sample is not None and sample[0] != self.last_sample[0] and self.densify and self.pending:
+            if self.reset is not None:
+                self.reset()
+            skipped = [self._infer(skipped_frame) for skipped_frame in self.pending]
+        else:
+            skipped = [sample if self.last_sample is None else self.last_sample] * len(self.pending)
+        for digit, confidence in [*skipped, sample]:
+            self.sequence.append(digit)
+            self.confidences.append(confidence)
+        self.pending.clear()
+        self.last_sample = sample
+
+
+class FrameReader:
+    """Decodes a video on a background thread into a bounded queue.
+
+    - The queue bound gives backpressure: decoding pauses once `max_queued` frames are waiting.
+    - Iterating yields `(frame_index, frame)` until the video (or `stop`) ends; a decoder failure is raised in the consumer.
+    - `start` seeks with `CAP_PROP_POS_FRAMES` before decoding, so a range of the video can be read on its own;
+      `seek_position` is the position the capture reports afterwards, which differs from `start` if the seek was inexact.
+    - Leaving the context (or `close()`) stops the decoder and releases the capture, also when the consumer stops early.
+    """
+
+    def __init__(self, video_path: str | Path, max_queued: int = DEFAULT_DECODE_QUEUE_SIZE, start: int = 0, stop: int | None = None) -> None:
+        """Open the video; decoding starts when the context is entered."""
+        self.cv2_module = cv2
+        self.cap = self.cv2_module.VideoCapture(str(video_path))
+        self.total_frames = int(self.cap.get(self.cv2_module.CAP_PROP_FRAME_COUNT))
+        if start > 0:
+            self.cap.set(self.cv2_module.CAP_PROP_POS_FRAMES, start)
+        self.seek_position = int(self.cap.get(self.cv2_module.CAP_PROP_POS_FRAMES))
+        self.start = start
+        self.stop = stop
+        self.frames: queue.Queue = queue.Queue(maxsize=max(1, max_queued))
+        self.stop_event = threading.Event()
+        self.error: Exception | None = None
+        self.frames_read = 0
+        self.thread = threading.Thread(target=self._decode, name="frame_reader", daemon=True)
+
+    def __enter__(self) -> Self:
+        """Start the decoder thread."""
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        """Stop the decoder thread and release the capture."""
+        self.close()
+
+    def __iter__(self) -> Iterator[tuple[int, np.ndarray]]:
+        """Yield decoded frames in order."""
+        while True:
+            item = self.frames.get()
+            if item is _END_OF_VIDEO:
+                if self.error is not None:
+                    msg = f"Video decoding failed: {self.error!s}"
+                    raise RuntimeError(msg) from self.error
+                return
+            frame_index = self.start + self.frames_read
+            self.frames_read += 1
+            yield frame_index, item
+
+    def close(self) -> None:
+        """Stop decoding and release the capture."""
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.cap.release()
+
+    def _decode(self) -> None:
+        try:
+            position = self.start
+            while not self.stop_event.is_set() and (self.stop is None or position < self.stop):
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                self._put(frame)
+                position += 1
+        except Exception as e:  # noqa: BLE001 - handed over to the consumer
+            self.error = e
+        finally:
+            self._put(_END_OF_VIDEO)
+
+    def _put(self, item: object) -> None:
+        while not self.stop_event.is_set():
+            try:
+                self.frames.put(item, timeout=QUEUE_POLL_INTERVAL_S)
+            except queue.Full:
+                continue
+            else:
+                return
+
+
+class HandsPool:
+    """Pool of pre-initialised MediaPipe Hands instances shared by the concurrent requests of a replica.
+
+    - Instances are created up front, so requests do not pay graph and model initialisation.
+    - `checkout()` lends an instance to one request at a time and resets its tracking state on return.
+    - The time spent waiting for a free instance is passed to `on_wait` (milliseconds).
+    - After `close()`, instances still lent out or awaited by requests keep serving those requests,
+      and each one is closed once it is returned with no request left waiting for it.
+    """
+
+    def __init__(self, size: int, factory: Callable[[], Hands], on_wait: Callable[[float], None] | None = None) -> None:
+        """Create `size` instances with `factory`."""
+        self.size = max(1, size)
+        self.on_wait = on_wait
+        self.instances: queue.Queue[Hands] = queue.Queue()
+        self.lock = threading.Lock()
+        self.waiting = 0  # requests blocked in `checkout` for an instance
+        self.closed = False
+        for _ in range(self.size):
+            self.instances.put(factory())
+
+    @contextmanager
+    def checkout(self) -> Iterator[Hands]:
+        """Borrow an instance for the duration of the context."""
+        start = time.perf_counter()
+        with self.lock:
+            self.waiting += 1
+        hands = self.instances.get()
+        with self.lock:
+            self.waiting -= 1
+        if self.on_wait is not None:
+            self.on_wait((time.perf_counter() - start) * 1000)
+        try:
+            yield hands
+        finally:
+            hands.reset()
+            with self.lock:
+                self.instances.put(hands)
+                idle = self._drain() if self.closed else []
+            for instance in idle:
+                instance.close()
+
+    def close(self) -> None:
+        """Close the idle instances that no request is waiting for; the others are closed as they are returned."""
+        with self.lock:
+            self.closed = True
+            idle = self._drain()
+        for instance in idle:
+            instance.close()
+
+    def _drain(self) -> list[Hands]:
+        # Called with the lock held: take the idle instances beyond the number of waiting requests
+        idle = []
+        while self.instances.qsize() > self.waiting:
+            idle.append(self.instances.get_nowait())
+        return idle
+
+
+class StreamingOTPSession:
+    """Incremental OTP verification over frames pushed while the user is still recording.
+
+    - Frames go through the same preparation, adaptive sampling and OTP matching as a recorded video.
+    - The first frame, the frame at `expected_frames // 2` and the last frame are kept for the face check.
+    - Once the matcher has decided, further frames are ignored; the stop frame stands in for the last one.
+    - The session owns its MediaPipe Hands instance, since it lives across several requests.
+    - `chunks_received` counts the chunks pushed so far, so the caller can detect a chunk that does not continue the session.
+    - After `finish` or `close`, the Hands instance and frame buffers are released and the session is `closed`.
+    """
+
+    def __init__(self, hands: Hands, stride: int = 1, *, densify: bool = True, inference_width: int = DEFAULT_INFERENCE_WIDTH) -> None:
+        """Set up the per-session frame pipeline; `start` must be called before the first frame."""
+        self.cv2_module = cv2
+        self.hands: Hands | None = hands
+        self.preparer = FramePreparer(inference_width, stride + 1)
+        self.sampler = AdaptiveFrameSampler(
+            lambda frame: count_fingers(self.hands.process(self.preparer.to_rgb(frame))),
+            stride,
+            densify=densify,
+            reset=hands.reset,
+        )
+        self.matcher: OTPMatcher | None = None
+        self.reference: memoryview | None = None  # JPEG encoded reference face sent with the first chunk
+        self.face_indices: set[int] = {0}
+        self.face_frames: dict[int, np.ndarray] = {}
+        self.last_frame: tuple[int, np.ndarray] | None = None
+        self.frames_received = 0
+        self.chunks_received = 0
+        self.matched_frames = 0
+        self.started = time.perf_counter()
+
+    @property
+    def done(self) -> bool:
+        """Whether the OTP outcome is already decided."""
+        return self.matcher is not None and self.matcher.done
+
+    def start(self, matcher: OTPMatcher, expected_frames: int = 0, reference: memoryview | None = None) -> None:
+        """Set the OTP matcher, the expected recording length (in frames) used to pick the middle face frame, and the sent reference face."""
+        self.matcher = matcher
+        self.reference = reference
+        if expected_frames > 0:
+            self.face_indices.add(expected_frames // 2)
+
+    def push_encoded(self, data: bytes) -> None:
+        """Decode a JPEG/PNG encoded frame and push it."""
+        frame = self.cv2_module.imdecode(np.frombuffer(data, dtype=np.uint8), self.cv2_module.IMREAD_COLOR)
+        if frame is None:
+            msg = "Failed to decode a streamed frame"
+            raise RuntimeError(msg)
+        self.push(frame)
+
+    def push(self, frame: np.ndarray) -> None:
+        """Run the next frame through hand inference and the OTP matcher."""
+        if self.done:
+            return
+        frame_index = self.frames_received
+        self.frames_received += 1
+        prepared = self.preparer.prepare(frame)
+        self.sampler.push(prepared)
+        if self.matcher is not None:
+            for digit, confidence in zip(self.sampler.sequence[self.matched_frames :], self.sampler.confidences[self.matched_frames :], strict=True):
+                self.matcher.push(digit, confidence)
+            self.matched_frames = len(self.sampler.sequence)
+        if frame_index in self.face_indices:
+            self.face_frames[frame_index] = frame  # full resolution for the face check
+        self.last_frame = (frame_index, frame)  # decoded frames are not reused, no copy needed
+
+    def finish(self) -> tuple[list[list[int | float]], dict[int, np.ndarray]]:
+        """Resolve the buffered frames, release the Hands instance and return the timeline and the face frames."""
+        self.sampler.flush()
+        if self.last_frame is not None and self.last_frame[0] not in self.face_frames:
+            self.face_frames[self.last_frame[0]] = self.last_frame[1]
+        timeline, face_frames = encode_timeline(self.sampler.sequence, self.sampler.confidences), self.face_frames
+        self.close()
+        return timeline, face_frames
+
+    @property
+    def closed(self) -> bool:
+        """Whether the session has released its Hands instance and can take no more frames."""
+        return self.hands is None
+
+    def close(self) -> None:
+        """Release the Hands instance and the buffered frames."""
+        if self.hands is not None:
+            self.hands.close()
+            self.hands = None
+        self.sampler.pending.clear()
+        self.face_frames = {}
+        self.last_frame = None
+        self.reference = None
+
+    def __del__(self) -> None:
+        """Release the Hands instance when the session is dropped without finishing."""
+        self.close()
@@ -1,9 +1,193 @@
 """VALIDATION UTILS."""
 
+from __future__ import annotations
 
-def is_valid_otp(otp_processed: list[int], expected_otp: list[int]) -> bool:
-    """Check if the processed OTP matches the expected OTP."""
-    last_occurrence = {str(val): idx for idx, val in enumerate(otp_processed)}
+import re
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+DEFAULT_MIN_HOLD = 3.0  # frames (at full confidence) a digit must be held to count
+DEFAULT_HYSTERESIS = 0.5  # extra hold, as a fraction of min_hold, needed to switch away from a held digit
+OTP_PATTERN = r"^\d{4}$"
+
+
+def is_otp_code(otp: object) -> bool:
+    """Whether `otp` is a well-formed OTP of exactly 4 digits."""
+    return isinstance(otp, str) and re.fullmatch(OTP_PATTERN, otp) is not None
+
+
+class DigitSegment(NamedTuple):
+    """A digit held over a range of frames."""
+
+    digit: int
+    start: int  # first frame
+    end: int  # last frame (inclusive)
+    weight: float  # summed frame confidence
+
+
+class DigitSegmenter:
+    """Linear-time streaming segmenter turning per-frame digits into held digit segments.
+
+    - A digit opens a segment once its run of frames reaches a confidence-weighted hold of `min_hold`.
+    - While a segment is open, a different digit needs `min_hold * (1 + hysteresis)` to replace it, and
+      shorter runs are absorbed into the open segment, so single-frame flicker never splits a segment.
+    - Frames can be pushed one at a time or as runs (`count`), e.g. from a run-length encoded timeline.
+    """
+
+    def __init__(self, min_hold: float = DEFAULT_MIN_HOLD, hysteresis: float = DEFAULT_HYSTERESIS) -> None:
+        """Set the hold threshold (in frames at full confidence) and the hysteresis factor."""
+        self.min_hold = min_hold
+        self.switch_hold = min_hold * (1 + hysteresis)
+        self.segments: list[DigitSegment] = []  # closed segments
+        self.current: DigitSegment | None = None  # open segment
+        self.candidate: DigitSegment | None = None  # run of a different digit that has not reached its hold yet
+        self.frame = 0
+
+    def push(self, digit: int, confidence: float = 1.0, count: int = 1) -> DigitSegment | None:
+        """Feed `count` frames showing `digit`; returns the segment closed by them, if any."""
+        start, end, weight = self.frame, self.frame + count - 1, confidence * count
+        self.frame += count
+
+        if self.current is not None and digit == self.current.digit:
+            self.current = self._absorb_candidate(end, weight)
+            return None
+
+        if self.candidate is not None and digit == self.candidate.digit:
+            self.candidate = self.candidate._replace(end=end, weight=self.candidate.weight + weight)
+        else:
+            if self.current is not None and self.candidate is not None:
+                self.current = self._absorb_candidate(self.candidate.end, 0.0)
+            self.candidate = DigitSegment(digit, start, end, weight)
+
+        if self.candidate.weight < (self.min_hold if self.current is None else self.switch_hold):
+            return None
+        closed = self.current
+        if closed is not None:
+            self.segments.append(closed)
+        self.current, self.candidate = self.candidate, None
+        return closed
+
+    def finish(self) -> list[DigitSegment]:
+        """Close the open segment and return all segments in order."""
+        if self.current is not None:
+            if self.candidate is not None:
+                self.current = self._absorb_candidate(self.candidate.end, 0.0)
+            self.segments.append(self.current)
+            self.current = None
+        return self.segments
+
+    def _absorb_candidate(self, end: int, weight: float) -> DigitSegment:
+        # Frames of an unconfirmed run count towards the open segment's frame range, not its weight
+        self.candidate = None
+        return self.current._replace(end=end, weight=self.current.weight + weight)
+
+
+def segment_digits(
+    otp_processed: Sequence[int],
+    confidences: Sequence[float] | None = None,
+    min_hold: float = DEFAULT_MIN_HOLD,
+    hysteresis: float = DEFAULT_HYSTERESIS,
+) -> list[DigitSegment]:
+    """Segment a per-frame digit sequence into held digit segments with frame ranges."""
+    segmenter = DigitSegmenter(min_hold, hysteresis)
+    for i, digit in enumerate(otp_processed):
+        segmenter.push(int(digit), 1.0 if confidences is None else confidences[i])
+    return segmenter.finish()
+
+
+def otp_from_segments(segments: Sequence[DigitSegment], expected_otp: Sequence[str]) -> list[str]:
+    """Order the OTP digits by their last held segment, ignoring digits outside the OTP."""
+    last_occurrence = {str(segment.digit): segment.end for segment in segments}
     sorted_values = sorted(last_occurrence.items(), key=lambda x: x[1])
-    otp_generated = [val for val, _ in sorted_values if val in expected_otp]
-    return expected_otp == otp_generated
+    return [val for val, _ in sorted_values if val in expected_otp]
+
+
+def is_valid_otp(
+    otp_processed: Sequence[int],
+    expected_otp: list[str],
+    confidences: Sequence[float] | None = None,
+    min_hold: float = DEFAULT_MIN_HOLD,
+    hysteresis: float = DEFAULT_HYSTERESIS,
+) -> bool:
+    """Check if the processed OTP matches the expected OTP.
+
+    Only digits held long enough to form a segment count, so single-frame flicker does not change the result.
+    """
+    segments = segment_digits(otp_processed, confidences, min_hold, hysteresis)
+    return list(expected_otp) == otp_from_segments(segments, expected_otp)
+
+
+def is_valid_otp_timeline(
+    timeline: Sequence[Sequence[float]],
+    expected_otp: list[str],
+    min_hold: float = DEFAULT_MIN_HOLD,
+    hysteresis: float = DEFAULT_HYSTERESIS,
+) -> bool:
+    """Check a run-length encoded `[digit, start_frame, length, mean_confidence]` timeline against the expected OTP.
+
+    Gives the same result as `is_valid_otp` on the expanded per-frame sequence and confidences, as long as the
+    timeline keeps the mean confidences at full precision; a hold landing exactly on a threshold may differ by float rounding.
+    """
+    segmenter = DigitSegmenter(min_hold, hysteresis)
+    for digit, _start, length, confidence in timeline:
+        segmenter.push(int(digit), confidence, int(length))
+    return list(expected_otp) == otp_from_segments(segmenter.finish(), expected_otp)
+
+
+class OTPMatcher:
+    """Incremental OTP matcher fed with one per-frame digit at a time.
+
+    - Digits are segmented with `DigitSegmenter` and ordered by their last held segment, the same rule as
+      `is_valid_otp`; digits outside the OTP are ignored.
+    - The match succeeds as soon as that order equals the OTP, so stopping there gives the verdict `is_valid_otp`
+      gives on the frames seen so far.
+    - It never fails early: a digit shown too early can still be shown again later, which corrects the order.
+      `finish` decides the outcome at the end of the recording.
+    """
+
+    PENDING = "pending"
+    MATCHED = "matched"
+    FAILED = "failed"
+
+    def __init__(
+        self,
+        expected_otp: list[str] | str,
+        min_hold: float = DEFAULT_MIN_HOLD,
+        hysteresis: float = DEFAULT_HYSTERESIS,
+    ) -> None:
+        """Set the expected OTP digits and the hold thresholds (in frames at full confidence)."""
+        self.expected = [int(digit) for digit in expected_otp]
+        self.segmenter = DigitSegmenter(min_hold, hysteresis)
+        self.last_held: dict[int, int] = {}  # OTP digit -> index of its last held segment
+        self.segment_start: int | None = None  # first frame of the open segment
+        self.segments_opened = 0
+        self.status = self.PENDING
+
+    @property
+    def done(self) -> bool:
+        """Whether the outcome is already decided."""
+        return self.status != self.PENDING
+
+    def push(self, digit: int, confidence: float = 1.0, count: int = 1) -> str:
+        """Feed the digit of the next `count` frames and return the match status."""
+        if self.done:
+            return self.status
+        self.segmenter.push(digit, confidence, count)
+        segment = self.segmenter.current
+        if segment is None or segment.start == self.segment_start:
+            return self.status
+        self.segment_start = segment.start
+        self.segments_opened += 1
+        if segment.digit in self.expected:
+            self.last_held[segment.digit] = self.segments_opened
+            if sorted(self.last_held, key=self.last_held.__getitem__) == self.expected:
+                self.status = self.MATCHED
+        return self.status
+
+    def finish(self) -> str:
+        """Decide the outcome at the end of the recording: matched if the OTP has been shown in order, else failed."""
+        if not self.done:
+            self.status = self.FAILED
+        return self.status
@@ -0,0 +1,29 @@
+"""Run the FastAPI gateway as a Ray Serve ingress deployment."""
+
+from ray import serve
+
+from backend.fast_api_server import OCR_MAX_CONCURRENCY, OTP_MAX_CONCURRENCY, UPSTREAM_TIMEOUT_S, app, logger, model_clients
+from backend.model_client import HandleModelClient
+
+OCR_APP_NAME = "id_ocr_server"
+OTP_APP_NAME = "model_server"
+
+
+@serve.deployment
+@serve.ingress(app)
+class Gateway:
+    """FastAPI gateway served by Ray Serve next to the model applications of ray_config.yaml.
+
+    The model deployments are called through deployment handles instead of the HTTP proxy,
+    which removes one network hop and the JSON encoding of every request and response.
+    `fastapi run backend/fast_api_server.py` keeps the HTTP clients for split deployments.
+    """
+
+    def __init__(self, ocr_app: str = OCR_APP_NAME, otp_app: str = OTP_APP_NAME) -> None:
+        """Point the gateway's model clients at the deployment handles of the model applications."""
+        model_clients["ocr"] = HandleModelClient(serve.get_deployment_handle("IDOCRProcessor", app_name=ocr_app), OCR_MAX_CONCURRENCY, UPSTREAM_TIMEOUT_S)
+        model_clients["otp"] = HandleModelClient(serve.get_deployment_handle("VideoOTPProcessor", app_name=otp_app), OTP_MAX_CONCURRENCY, UPSTREAM_TIMEOUT_S)
+        logger.info(f"Gateway calling model deployments through handles ({ocr_app}, {otp_app}).")
+
+
+gateway_app = Gateway.bind()
@@ -0,0 +1,43 @@
+"""In-flight request coalescing for the FastAPI gateway."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, TypeVar
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable, Hashable
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single execution.
+
+    - The first caller for a key starts the call; callers arriving while it runs await the same result.
+    - The key is released as soon as the call finishes, so later calls run again (completed results are not cached).
+    - The shared call is shielded: a caller that disconnects does not cancel it for the others.
+    - Callers share the result object and must not mutate it.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the in-flight table and counters."""
+        self.calls: dict[Hashable, asyncio.Task] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run `fn()` unless a call for `key` is already in flight, and return its result."""
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict[str, int]:
+        """Return the started/coalesced counters and the number of calls in flight."""
+        return {"started": self.started, "coalesced": self.coalesced, "in_flight": len(self.calls)}
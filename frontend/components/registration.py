@@ -1,8 +1,13 @@
 """Handle functionalities related to Registration."""
+import contextlib
 import hashlib
+import json
+import os
+import re
 import secrets
 import sys
 import time
+from http import HTTPStatus
 from pathlib import Path
 from typing import BinaryIO
 
@@ -11,13 +16,29 @@ import httpx
 import streamlit as st
 import yaml
 from loguru import logger
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
+from websockets.sync.client import ClientConnection, connect
 
 sys.path.append(str(Path(__file__).parent.resolve().parent.parent))
 from unified_logging.config_types import LoggingConfigs
 from unified_logging.logging_client import setup_network_logger_client
 
-FASTAPI_PROCESS_URL = "http://127.0.0.1:8000/validate-otp"
-FASTAPI_OCR_URL = "http://127.0.0.1:8000/ocr-content"
+FASTAPI_BASE_URL = os.environ.get("FASTAPI_BASE_URL", "127.0.0.1:8000")  # 127.0.0.1:8055 for the Ray Serve ingress gateway
+FASTAPI_JOBS_URL = f"http://{FASTAPI_BASE_URL}/jobs"
+FASTAPI_UPLOADS_URL = f"http://{FASTAPI_BASE_URL}/uploads"
+UPLOAD_ROUTES = {"ocr": "id-proof", "otp": "otp-video"}
+FASTAPI_STREAM_URL = f"ws://{FASTAPI_BASE_URL}/ws/validate-otp"
+FASTAPI_CACHE_INVALIDATE_URL = f"http://{FASTAPI_BASE_URL}/cache/invalidate"
+STREAM_OTP = True  # verify while recording by streaming frames; False records the mp4 and validates it afterwards
+UPLOAD_FILES = False  # send the ID image / recording bytes to the backend instead of relying on a shared user_data folder
+ARCHIVE_RECORDING = True  # also write the mp4 when streaming; the profile page plays it, and it is validated instead if the stream drops
+STREAM_FRAME_WIDTH = 640  # frames are downscaled to this width before streaming
+STREAM_JPEG_QUALITY = 80
+STREAM_VERDICT_TIMEOUT_S = 30
+BACKEND_REQUEST_TIMEOUT_S = 10.0  # per HTTP call; model runs are polled as jobs instead of holding the connection
+JOB_POLL_INTERVAL_S = 0.5
+JOB_TIMEOUT_S = 120  # give up on a job (including waits for a busy backend) after this long
+USERNAME_PATTERN = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9_.-]{0,254}")  # a single folder name, as the backend's UID_PATTERN accepts
 # Registration steps
 reg_step_1 = 1  # Doc and user name
 reg_step_2 = 2  # Remaining account details
@@ -61,6 +82,167 @@ def purge_output_folder(output_folder: Path) -> None:
 
 
 
+def open_otp_stream(otp: str, expected_frames: int) -> ClientConnection:
+    """Open the OTP verification stream for the current user."""
+    stream = connect(f"{FASTAPI_STREAM_URL}/{st.session_state.username}")
+    stream.send(json.dumps({"otp": otp, "expected_frames": expected_frames}))
+    return stream
+
+def start_otp_stream(otp: str, expected_frames: int) -> ClientConnection | None:
+    """Open the OTP stream when streaming is on; None falls back to recording the mp4 and uploading it afterwards."""
+    if not STREAM_OTP:
+        return None
+    try:
+        return open_otp_stream(otp, expected_frames)
+    except (OSError, InvalidHandshake, ConnectionClosed) as e:  # refused connection, open timeout or rejected handshake
+        logger.warning(f"OTP stream unavailable, uploading the recording instead: {e!s}")
+        return None
+
+def stream_frame(stream: ClientConnection, frame: cv2.typing.MatLike) -> dict | None:
+    """Send a downscaled JPEG frame; returns the verdict if the backend has already decided.
+
+    Raises ConnectionClosed if the backend closed the stream, e.g. on a restart.
+    """
+    try:
+        return json.loads(stream.recv(timeout=0))
+    except TimeoutError:
+        pass  # no verdict yet
+    scale = STREAM_FRAME_WIDTH / frame.shape[1]
+    if scale < 1:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    _, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, STREAM_JPEG_QUALITY])
+    stream.send(encoded.tobytes())
+    return None
+
+def finish_otp_stream(stream: ClientConnection) -> dict:
+    """Signal the end of the recording and wait for the verdict."""
+    with contextlib.suppress(ConnectionClosed):  # the backend closes the stream once it has sent an early verdict
+        stream.send(json.dumps({"event": "end"}))
+    try:
+        return json.loads(stream.recv(timeout=STREAM_VERDICT_TIMEOUT_S))
+    finally:
+        stream.close()
+
+def open_video_writer(video_path: Path, cap: cv2.VideoCapture, fps: float, stream: ClientConnection | None) -> cv2.VideoWriter | None:
+    """Open the mp4 writer, unless frames are streamed and archiving is off."""
+    if stream is not None and not ARCHIVE_RECORDING:
+        return None
+    fourcc = cv2.VideoWriter_fourcc(*"mp4v")  # MP4 codec
+    frame_width = int(cap.get(3))
+    frame_height = int(cap.get(4))
+    return cv2.VideoWriter(str(video_path), fourcc, fps, (frame_width, frame_height))
+
+def handle_recorded_frame(frame: cv2.typing.MatLike, out: cv2.VideoWriter | None, stream: ClientConnection | None) -> dict | None:
+    """Archive and/or stream a recorded frame; returns the verdict if the backend has already decided."""
+    if out is not None:
+        out.write(frame)  # Write frame to video file
+    return stream_frame(stream, frame) if stream is not None else None
+
+def drop_otp_stream(stream: ClientConnection, error: ConnectionClosed) -> None:
+    """Give up on a stream the backend closed mid-recording; the archived recording is validated afterwards instead."""
+    logger.warning(f"OTP stream closed while recording, validating the recording afterwards: {error!s}")
+    stream.close()
+
+def release_recording(cap: cv2.VideoCapture, out: cv2.VideoWriter | None) -> None:
+    """Release the webcam and the video writer."""
+    cap.release()  # Release webcam
+    if out is not None:
+        out.release()  # Release video writer
+
+def invalidate_cached_results(client: httpx.Client) -> None:
+    """Drop the backend's cached results for the user after their files were rewritten."""
+    client.post(f"{FASTAPI_CACHE_INVALIDATE_URL}/{st.session_state.username}")
+
+def submit_backend_job(client: httpx.Client, kind: str, payload: dict, upload: bytes | None) -> httpx.Response:
+    """Post an `ocr` / `otp` job, as a multipart upload of the file bytes when `upload` is given."""
+    if upload is None:
+        return client.post(f"{FASTAPI_JOBS_URL}/{kind}", json=payload)
+    return client.post(f"{FASTAPI_UPLOADS_URL}/{UPLOAD_ROUTES[kind]}", data=payload, files={"file": upload})
+
+class BackendJobLostError(LookupError):
+    """Raised when polling a job the backend no longer knows.
+
+    Jobs live in the memory of the gateway worker they were submitted to, so this happens when the poll reaches
+    another worker, the worker restarted, or the result expired.
+    """
+
+    def __init__(self, kind: str, job_id: str) -> None:
+        """Record the lost job."""
+        super().__init__(f"Backend lost {kind} job {job_id}")
+
+def run_backend_job(client: httpx.Client, kind: str, payload: dict, upload: bytes | None = None) -> dict:
+    """Submit an `ocr` / `otp` job to the backend and poll until its result is ready.
+
+    Waits for the Retry-After delay while the backend's job queue is saturated; raises TimeoutError after `JOB_TIMEOUT_S`,
+    and BackendJobLostError if the backend no longer knows the job.
+    """
+    deadline = time.monotonic() + JOB_TIMEOUT_S
+    response = submit_backend_job(client, kind, payload, upload)
+    while response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+        retry_after = float(response.headers.get("Retry-After", 1))
+        if time.monotonic() + retry_after > deadline:
+            msg = f"Backend busy, {kind} job not accepted"
+            raise TimeoutError(msg)
+        logger.warning(f"Backend busy, retrying {kind} job in {retry_after} s")
+        time.sleep(retry_after)
+        response = submit_backend_job(client, kind, payload, upload)
+    response.raise_for_status()
+    job = response.json()
+    while job["status"] in ("queued", "running"):
+        if time.monotonic() > deadline:
+            msg = f"{kind} job {job['job_id']} did not finish in {JOB_TIMEOUT_S} s"
+            raise TimeoutError(msg)
+        time.sleep(JOB_POLL_INTERVAL_S)
+        poll = client.get(f"{FASTAPI_JOBS_URL}/{job['job_id']}")
+        if poll.status_code == HTTPStatus.NOT_FOUND:
+            raise BackendJobLostError(kind, job["job_id"])
+        poll.raise_for_status()
+        job = poll.json()
+    if job["status"] != "done":
+        logger.error(f"{kind} job {job['job_id']} failed: {job.get('error')}")
+        return {}
+    return job["result"]
+
+def request_otp_verdict(otp: str, stream: ClientConnection | None, early_verdict: dict | None) -> dict:
+    """Return the verdict of the OTP stream, or validate the recorded video when not streaming or the stream dropped."""
+    if stream is not None:
+        if early_verdict is not None:
+            stream.close()
+            return early_verdict
+        try:
+            return finish_otp_stream(stream)
+        except ConnectionClosed as e:
+            if not Path(st.session_state.video_path).exists():
+                raise
+            logger.warning(f"OTP stream closed before the verdict, validating the recording instead: {e!s}")
+    with httpx.Client(timeout=BACKEND_REQUEST_TIMEOUT_S) as client:
+        invalidate_cached_results(client)
+        upload = Path(st.session_state.video_path).read_bytes() if UPLOAD_FILES else None
+        return run_backend_job(client, "otp", {"otp": otp,"uid":st.session_state.username}, upload)
+
+def show_otp_verdict(otp: str, stream: ClientConnection | None, early_verdict: dict | None) -> None:
+    """Request the OTP verdict and move on to the profile page if it is valid."""
+    try:
+        process_response = request_otp_verdict(otp, stream, early_verdict)
+        if process_response.get("valid"):
+            logger.info("OTP validation successful. Redirecting to profile page.")
+            st.switch_page("pages/profile_page.py")
+        else:
+            logger.warning("Invalid otp provided")
+            st.toast(":red[Invalid Response received]")
+    except (ConnectionError, ConnectionClosed): # raise connection errors
+        logger.error("Backend connection failed.")
+        st.toast("Backend connection failed")
+    except TimeoutError:
+        logger.error("OTP validation timed out.")
+        st.toast("Backend is busy. Try Again")
+    except BackendJobLostError as e:
+        logger.error(str(e))
+        st.toast("Backend lost the request. Try Again")
+    except Exception:  # raise unexpected errors
+        st.toast("An unexpected error occurred. Check log")
+        raise
+
 def record_live_video(user_folder: Path) -> None:
     """Record a 5-second live video and store it in a user-specific folder."""
     logger.info(f"Starting video recording for user: {st.session_state.username}")
@@ -83,15 +265,13 @@ def record_live_video(user_folder: Path) -> None:
         st.toast("Recording video for 5 seconds...")
 
         cap = cv2.VideoCapture(0)  # Open webcam
-        fourcc = cv2.VideoWriter_fourcc(*"mp4v")  # MP4 codec
         fps = 20.0
-        frame_width = int(cap.get(3))
-        frame_height = int(cap.get(4))
-
-        out = cv2.VideoWriter(str(video_path), fourcc, fps, (frame_width, frame_height))
+        max_time = 7
+        stream = start_otp_stream(otp, int(fps * max_time))
+        out = open_video_writer(video_path, cap, fps, stream)
 
         start_time = time.time()
-        max_time = 7
+        early_verdict = None
         while True:
             elapsed_time = time.time() - start_time
             if elapsed_time > max_time:
@@ -102,7 +282,13 @@ def record_live_video(user_folder: Path) -> None:
                 st.write("Failed to capture frame.")
                 break
 
-            out.write(frame)  # Write frame to video file
+            try:
+                early_verdict = handle_recorded_frame(frame, out, stream)
+            except ConnectionClosed as e:
+                drop_otp_stream(stream, e)
+                stream = None
+            if early_verdict is not None:
+                break  # verdict already decided
 
             # Convert frame from BGR to RGB for Streamlit display
             frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -111,9 +297,8 @@ def record_live_video(user_folder: Path) -> None:
             # Update progress bar
             progress_bar.progress(min(int((elapsed_time / 5) * 100), 100))
 
-        cap.release()  # Release webcam
-        out.release()  # Release video writer
-        if video_path.exists():
+        release_recording(cap, out)
+        if stream is not None or video_path.exists():
             st.toast("Recording uploaded. Please wait while we process")
             progress_bar.empty()  # Reset progress bar
 
@@ -130,21 +315,7 @@ def record_live_video(user_folder: Path) -> None:
 
             # Store video path in session state and navigate to review page
             st.session_state.video_path = str(video_path)
-            try:
-                with httpx.Client(timeout=1000.0) as client:
-                    process_response = client.post(FASTAPI_PROCESS_URL, json ={"otp": otp,"uid":st.session_state.username}).json()
-                if process_response.get("valid"):
-                    logger.info("OTP validation successful. Redirecting to profile page.")
-                    st.switch_page("pages/profile_page.py")
-                else:
-                    logger.warning("Invalid otp provided")
-                    st.toast(":red[Invalid Response received]")
-            except ConnectionError: # raise connection errors
-                logger.error("Backend connection failed.")
-                st.toast("Backend connection failed")
-            except Exception:  # raise unexpected errors
-                st.toast("An unexpected error occurred. Check log")
-                raise
+            show_otp_verdict(otp, stream, early_verdict)
 
 def check_username_availability(user_data_dir: Path, username: str) -> bool:
     """Check if a username is available."""
@@ -164,13 +335,15 @@ def save_user_document(user_data_dir: Path, document: BinaryIO) -> None:
     user_folder = user_data_dir / st.session_state.username
     user_folder.mkdir(parents=True, exist_ok=True)
 
+    content = document.read()
     with (user_folder / "id_proof.jpg").open("wb") as f:
-        f.write(document.read())
+        f.write(content)
 
     logger.info(f"Document saved for {st.session_state.username}")
     try:
-        with httpx.Client(timeout=1000.0) as client:
-            process_response = client.post(FASTAPI_OCR_URL, json ={"uid":st.session_state.username}).json()
+        with httpx.Client(timeout=BACKEND_REQUEST_TIMEOUT_S) as client:
+            invalidate_cached_results(client)
+            process_response = run_backend_job(client, "ocr", {"uid":st.session_state.username}, content if UPLOAD_FILES else None)
         if process_response.get("valid"):
             st.toast(":green[Document Registered successfully]")
             st.session_state.ocr = process_response.get("text")
@@ -179,6 +352,11 @@ def save_user_document(user_data_dir: Path, document: BinaryIO) -> None:
             st.toast("Invalid Doc data. Try Again")
     except ConnectionError: # raise connection errors
         st.toast("Backend connection failed")
+    except TimeoutError:
+        st.toast("Backend is busy. Try Again")
+    except BackendJobLostError as e:
+        logger.error(str(e))
+        st.toast("Backend lost the request. Try Again")
     except Exception:  # raise unexpected errors
         st.toast("An unexpected error occurred. Check log")
         raise
@@ -254,6 +432,10 @@ def register_page() -> None:
                     st.toast(":red[Please fill all the fields]")
                     return
 
+                if not USERNAME_PATTERN.fullmatch(st.session_state.username):
+                    st.toast(":red[Username may only contain letters, digits, '_', '-' and '.', and not start with '.']")
+                    return
+
                 if not check_username_availability(user_data_dir, st.session_state.username):
                     st.toast(":red[Username already taken. Please choose another.]")
                     return
@@ -0,0 +1,135 @@
+"""Tests for request deadlines, cancellation and the abandoned-work accounting."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("ray")
+
+from backend.model_client import ModelClient
+from backend.model_server.deadline import Deadline, DeadlineExceededError, WastedWork, await_within
+
+
+def test_deadline_without_budget_never_expires() -> None:
+    deadline = Deadline.from_request({})
+    assert deadline.remaining() is None
+    assert deadline.reason is None
+    deadline.check("inference")
+
+
+def test_deadline_expires_after_its_budget() -> None:
+    deadline = Deadline.from_request({"timeout_s": 0.05})
+    assert 0 < deadline.remaining() <= 0.05
+    deadline.check("inference")
+    time.sleep(0.06)
+    assert deadline.remaining() == 0.0
+    with pytest.raises(DeadlineExceededError, match="deadline exceeded during inference") as exceeded:
+        deadline.check("inference")
+    assert (exceeded.value.stage, exceeded.value.reason) == ("inference", "deadline")
+
+
+def test_cancel_wins_over_the_budget() -> None:
+    deadline = Deadline(60.0)
+    deadline.cancel()
+    with pytest.raises(DeadlineExceededError, match="cancelled during decode") as exceeded:
+        deadline.check("decode")
+    assert exceeded.value.reason == "cancelled"
+
+
+def checked_work(deadline: Deadline, stopped: threading.Event) -> None:
+    """Worker loop that stops at the first check after the deadline is cancelled."""
+    try:
+        while True:
+            deadline.check("inference")
+            time.sleep(0.005)
+    except DeadlineExceededError:
+        stopped.set()
+
+
+def test_await_within_returns_on_timeout_and_stops_the_work() -> None:
+    async def scenario() -> None:
+        deadline, wasted, stopped = Deadline(0.05), WastedWork(), threading.Event()
+        loop = asyncio.get_running_loop()
+        with pytest.raises(DeadlineExceededError) as exceeded:
+            await await_within(deadline, wasted, lambda: loop.run_in_executor(None, checked_work, deadline, stopped))
+        assert exceeded.value.reason == "deadline"
+        assert deadline.cancelled.is_set()
+        await asyncio.to_thread(stopped.wait, 1.0)
+        await asyncio.sleep(0.01)  # the abandoned work is counted once it has stopped
+        assert wasted.totals == {"deadline": 1}
+
+    asyncio.run(scenario())
+
+
+def test_await_within_stops_the_work_of_a_cancelled_request() -> None:
+    async def scenario() -> None:
+        deadline, wasted, stopped = Deadline(), WastedWork(), threading.Event()
+        loop = asyncio.get_running_loop()
+        request = asyncio.ensure_future(await_within(deadline, wasted, lambda: loop.run_in_executor(None, checked_work, deadline, stopped)))
+        await asyncio.sleep(0.02)
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        await asyncio.to_thread(stopped.wait, 1.0)
+        await asyncio.sleep(0.01)
+        assert stopped.is_set()
+        assert wasted.totals == {"cancelled": 1}
+
+    asyncio.run(scenario())
+
+
+def test_await_within_skips_expired_requests() -> None:
+    async def scenario() -> None:
+        deadline, wasted = Deadline(), WastedWork()
+        deadline.cancel()
+        started = []
+
+        async def work() -> None:
+            started.append(True)
+
+        with pytest.raises(DeadlineExceededError, match="during queue"):
+            await await_within(deadline, wasted, work)
+        assert started == []
+        assert wasted.totals == {"cancelled": 1}
+
+    asyncio.run(scenario())
+
+
+def test_await_within_returns_the_result_in_time() -> None:
+    async def scenario() -> None:
+        async def work() -> dict:
+            return {"valid": True}
+
+        wasted = WastedWork()
+        assert await await_within(Deadline(1.0), wasted, work) == {"valid": True}
+        assert wasted.totals == {}
+
+    asyncio.run(scenario())
+
+
+def test_model_client_gives_up_waiting_for_a_slot_within_its_budget() -> None:
+    class StalledClient(ModelClient):
+        """Holds its slot until `release` is set."""
+
+        def __init__(self) -> None:
+            super().__init__(max_concurrency=1, timeout_s=0.1)
+            self.release = asyncio.Event()
+
+        async def _request(self, _payload: dict, _session_id: str | None, _timeout_s: float) -> dict:
+            await self.release.wait()
+            return {"valid": True}
+
+    async def scenario() -> None:
+        client = StalledClient()
+        held = asyncio.ensure_future(client.request({}))
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        assert "error" in await client.request({})
+        assert time.monotonic() - started < 0.2
+        client.release.set()
+        assert await held == {"valid": True}
+        assert await client.request({}) == {"valid": True}  # the slot is released again
+
+    asyncio.run(scenario())
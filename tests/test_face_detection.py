@@ -0,0 +1,61 @@
+"""Tests for choosing the face detector backend from the deployment config."""
+
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("cv2")
+
+import numpy as np
+
+from backend.model_server.face_detection import DownscaledHaarFaceDetector, FaceDetector, HaarFaceDetector, build_face_detector
+
+
+def test_builds_the_configured_backend_with_its_options() -> None:
+    detector = build_face_detector({"backend": "haar_refine", "options": {"detect_width": 240}})
+    assert isinstance(detector, DownscaledHaarFaceDetector)
+    assert detector.detect_width == 240
+
+
+def test_defaults_to_haar() -> None:
+    assert type(build_face_detector()) is HaarFaceDetector
+
+
+def test_unknown_backend_is_rejected() -> None:
+    with pytest.raises(ValueError, match="Unknown face detector backend"):
+        build_face_detector({"backend": "mtcnn"})
+
+
+def test_yunet_without_its_model_falls_back_to_haar(tmp_path: Path) -> None:
+    detector = build_face_detector({"backend": "yunet", "options": {"model_path": str(tmp_path / "missing.onnx")}})
+    assert type(detector) is HaarFaceDetector
+
+
+def test_variant_changes_with_the_detection_settings() -> None:
+    coarse = build_face_detector({"backend": "haar_refine", "options": {"detect_width": 240}})
+    fine = build_face_detector({"backend": "haar_refine", "options": {"detect_width": 480}})
+    assert coarse.variant() != fine.variant()
+    assert coarse.variant() == build_face_detector({"backend": "haar_refine", "options": {"detect_width": 240}}).variant()
+    assert build_face_detector().variant().startswith("haar,")
+
+
+class NoFaceDetector(FaceDetector):
+    name = "none"
+
+    def _detect(self, _image: np.ndarray) -> list:
+        return []
+
+
+def test_every_detection_is_reported_to_the_observer() -> None:
+    observed = []
+    detector = NoFaceDetector()
+    detector.observe = lambda backend, elapsed_ms: observed.append((backend, elapsed_ms))
+    faces, elapsed_ms = detector.detect_timed(np.zeros((120, 160), dtype=np.uint8))
+    assert faces == []
+    assert observed == [("none", elapsed_ms)]
+
+
+def test_built_detectors_report_to_the_observer() -> None:
+    def observe(_backend: str, _elapsed_ms: float) -> None: ...
+
+    assert build_face_detector({"backend": "haar_refine"}, observe).observe is observe
@@ -0,0 +1,77 @@
+"""Tests for the adaptive hand inference sampling of the OTP video pipeline."""
+
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("mediapipe")
+pytest.importorskip("ray")
+
+import numpy as np
+
+from backend.model_server.video_processing import AdaptiveFrameSampler, FramePreparer
+
+
+class FakeTracker:
+    """Stands in for MediaPipe Hands: frames are their own digit, and calls are recorded in order."""
+
+    def __init__(self) -> None:
+        self.calls: list[int | str] = []
+
+    def infer(self, frame: tuple[int, int]) -> tuple[int, float]:
+        index, digit = frame
+        self.calls.append(index)
+        return digit, 1.0
+
+    def reset(self) -> None:
+        self.calls.append("reset")
+
+
+def sample(digits: list[int], stride: int) -> tuple[list[int], FakeTracker]:
+    tracker = FakeTracker()
+    sampler = AdaptiveFrameSampler(tracker.infer, stride, reset=tracker.reset)
+    for frame in enumerate(digits):
+        sampler.push(frame)
+    return sampler.flush(), tracker
+
+
+def test_runs_of_at_least_stride_match_full_rate() -> None:
+    digits = [1] * 7 + [2] * 5 + [3] * 4 + [1] * 6
+    sequence, tracker = sample(digits, stride=3)
+    assert sequence == digits
+    assert tracker.calls.count("reset") >= 1
+    assert len([call for call in tracker.calls if call != "reset"]) < len(digits)
+
+
+def test_tracker_sees_frames_in_order_between_resets() -> None:
+    _, tracker = sample([1] * 5 + [2] * 4 + [4] * 7 + [0] * 3, stride=4)
+    since_reset: list[int] = []
+    for call in tracker.calls:
+        if call == "reset":
+            since_reset = []
+            continue
+        assert not since_reset or call > since_reset[-1]
+        since_reset.append(call)
+
+
+def test_sub_stride_flicker_is_not_seen() -> None:
+    # A B A within one stride window: both samples agree, so the flicker is filled over
+    digits = [1] * 7 + [2] + [1] * 4  # frames 0, 3, 6, 9 are sampled
+    sequence, tracker = sample(digits, stride=3)
+    assert sequence == [1] * len(digits)
+    assert "reset" not in tracker.calls
+
+
+def test_stride_one_infers_every_frame() -> None:
+    digits = [1, 2, 1, 3, 3]
+    sequence, tracker = sample(digits, stride=1)
+    assert sequence == digits
+    assert tracker.calls == list(range(len(digits)))
+
+
+def test_frame_preparer_reuses_its_buffers() -> None:
+    preparer = FramePreparer(max_width=64, slots=2)
+    for _ in range(10):
+        small = preparer.prepare(np.zeros((96, 128, 3), dtype=np.uint8))
+        preparer.to_rgb(small)
+    assert small.shape == (48, 64, 3)
+    assert preparer.allocations == 3  # two resize slots and the RGB buffer
@@ -0,0 +1,108 @@
+"""Tests for the gateway result cache and the coalescing of its misses."""
+
+import asyncio
+import os
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+from backend.gateway_cache import GatewayCache, LRUCacheBackend
+from backend.single_flight import SingleFlight
+
+
+def upload(path: Path, content: bytes, mtime_ns: int) -> None:
+    path.write_bytes(content)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+async def settle() -> None:
+    """Let the started fetches run up to the upstream call."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def read_upload(path: Path) -> bytes:
+    return path.read_bytes()
+
+
+def make_compute(path: Path, calls: list[bytes], release: asyncio.Event) -> Callable[[], Awaitable[tuple[dict, bool]]]:
+    """Slow upstream call answering with the content of the file it read when it started."""
+
+    async def compute() -> tuple[dict, bool]:
+        content = read_upload(path)
+        calls.append(content)
+        await release.wait()
+        return {"content": content.decode()}, True
+
+    return compute
+
+
+def test_reupload_does_not_join_the_call_on_the_previous_file(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        source = tmp_path / "id_proof.jpg"
+        upload(source, b"v1", 1_000_000_000)
+        cache = GatewayCache(LRUCacheBackend(), SingleFlight())
+        calls: list[bytes] = []
+        release = asyncio.Event()
+        compute = make_compute(source, calls, release)
+
+        first = asyncio.ensure_future(cache.fetch("ocr", "user", source, "", compute))
+        await settle()
+        joined = asyncio.ensure_future(cache.fetch("ocr", "user", source, "", compute))
+        await settle()
+        assert calls == [b"v1"]  # same file version: coalesced into the first call
+
+        upload(source, b"v2-new", 2_000_000_000)
+        second = asyncio.ensure_future(cache.fetch("ocr", "user", source, "", compute))
+        await settle()
+        assert calls == [b"v1", b"v2-new"]  # re-uploaded file: a call of its own
+
+        release.set()
+        assert await first == {"content": "v1"}
+        assert await joined == {"content": "v1"}
+        assert await second == {"content": "v2-new"}
+
+        # The v1 response is not served (nor stored) for the current file
+        assert await cache.fetch("ocr", "user", source, "", compute) == {"content": "v2-new"}
+        assert len(calls) == 2
+        assert cache.in_flight.stats() == {"started": 2, "coalesced": 1, "in_flight": 0}
+
+    asyncio.run(scenario())
+
+
+def test_response_is_not_stored_if_the_file_changed_during_the_call(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        source = tmp_path / "live_recording.mp4"
+        upload(source, b"v1", 1_000_000_000)
+        cache = GatewayCache(LRUCacheBackend(), SingleFlight())
+        calls: list[bytes] = []
+        release = asyncio.Event()
+        compute = make_compute(source, calls, release)
+
+        pending = asyncio.ensure_future(cache.fetch("otp", "user", source, "1234", compute))
+        await settle()
+        upload(source, b"v2-new", 2_000_000_000)
+        release.set()
+        assert await pending == {"content": "v1"}
+        assert len(cache.backend) == 0
+
+    asyncio.run(scenario())
+
+
+def test_cached_response_is_reused_until_the_file_changes(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        source = tmp_path / "id_proof.jpg"
+        upload(source, b"v1", 1_000_000_000)
+        cache = GatewayCache(LRUCacheBackend())
+        calls: list[bytes] = []
+        release = asyncio.Event()
+        release.set()
+        compute = make_compute(source, calls, release)
+
+        assert await cache.fetch("ocr", "user", source, "", compute) == {"content": "v1"}
+        assert await cache.fetch("ocr", "user", source, "", compute) == {"content": "v1"}
+        upload(source, b"v2-new", 2_000_000_000)
+        assert await cache.fetch("ocr", "user", source, "", compute) == {"content": "v2-new"}
+        assert calls == [b"v1", b"v2-new"]
+        assert cache.stats()["kinds"]["ocr"] == {"hits": 1, "misses": 2, "hit_rate": 0.333}
+
+    asyncio.run(scenario())
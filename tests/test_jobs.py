@@ -0,0 +1,76 @@
+"""Tests for the gateway job queue: backlog bounds, retention and outcomes."""
+
+import asyncio
+from collections.abc import Awaitable, Callable
+
+import pytest
+
+from backend.jobs import Job, JobQueue, JobQueueFullError
+
+
+def blocked_job(release: asyncio.Event, result: dict | None = None) -> Callable[[], Awaitable[dict]]:
+    async def run() -> dict:
+        await release.wait()
+        return result or {}
+
+    return run
+
+
+def test_submissions_beyond_the_backlog_are_rejected_with_a_retry_delay() -> None:
+    async def scenario() -> None:
+        queue = JobQueue(max_running=1, max_queued=1)
+        release = asyncio.Event()
+        running = queue.submit("ocr", "a", blocked_job(release))
+        await asyncio.sleep(0)
+        queued = queue.submit("ocr", "b", blocked_job(release))
+        await asyncio.sleep(0)
+        assert (running.status, queued.status) == (Job.RUNNING, Job.QUEUED)
+
+        with pytest.raises(JobQueueFullError) as rejected:
+            queue.submit("ocr", "c", blocked_job(release))
+        assert rejected.value.retry_after_s == queue.retry_after_s(1) == 2  # mean duration 1 s, one job ahead plus this one
+        assert queue.stats()["rejected"] == 1
+
+        release.set()
+        await asyncio.gather(running.done.wait(), queued.done.wait())
+        assert queue.submit("ocr", "c", blocked_job(release)).status == Job.QUEUED  # backlog drained: accepted again
+        await queue.close()
+
+    asyncio.run(scenario())
+
+
+def test_finished_jobs_are_kept_for_the_result_ttl() -> None:
+    async def scenario() -> None:
+        queue = JobQueue(result_ttl_s=0.05)
+        release = asyncio.Event()
+        release.set()
+        job = queue.submit("otp", "a", blocked_job(release, {"valid": True}))
+        await job.done.wait()
+        assert queue.get(job.id).snapshot()["result"] == {"valid": True}
+
+        queue.submit("otp", "b", blocked_job(release))  # submissions prune expired results
+        assert queue.get(job.id) is job
+        await asyncio.sleep(0.1)
+        queue.submit("otp", "c", blocked_job(release))
+        assert queue.get(job.id) is None
+        await queue.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_job_reports_its_error() -> None:
+    async def scenario() -> None:
+        queue = JobQueue()
+
+        async def fail() -> dict:
+            msg = "upstream down"
+            raise RuntimeError(msg)
+
+        job = queue.submit("ocr", "a", fail)
+        await job.done.wait()
+        snapshot = job.snapshot()
+        assert (snapshot["status"], snapshot["error"]) == (Job.FAILED, "upstream down")
+        assert "result" not in snapshot
+        assert queue.stats()["completed"] == 1
+
+    asyncio.run(scenario())
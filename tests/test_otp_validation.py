@@ -0,0 +1,66 @@
+"""Tests for the OTP digit segmentation, the validators and the incremental matcher."""
+
+import random
+
+import pytest
+
+from backend.otp_validation import OTPMatcher, is_otp_code, is_valid_otp
+
+OTP = "1234"
+
+
+def expand(runs: list[tuple[int, int]]) -> list[int]:
+    return [digit for digit, length in runs for _ in range(length)]
+
+
+def run_matcher(frames: list[int], otp: str = OTP) -> tuple[str, int]:
+    """Feed frames until the matcher decides; returns its final status and the number of frames it read."""
+    matcher = OTPMatcher(otp)
+    for read, digit in enumerate(frames, start=1):
+        if matcher.push(digit) != OTPMatcher.PENDING:
+            return matcher.status, read
+    return matcher.finish(), len(frames)
+
+
+@pytest.mark.parametrize(
+    ("runs", "valid"),
+    [
+        ([(0, 5), (1, 10), (2, 10), (3, 10), (4, 10)], True),
+        ([(0, 5), (3, 10), (1, 15), (2, 15), (3, 15), (4, 15)], True),  # 3 shown too early, then corrected
+        ([(1, 10), (2, 10), (4, 10), (3, 10)], False),
+        ([(1, 10), (2, 1), (3, 10), (4, 10)], False),  # 2 only flickers
+        ([(1, 10), (7, 10), (2, 10), (3, 10), (4, 10)], True),  # digits outside the OTP are ignored
+    ],
+)
+def test_matcher_agrees_with_is_valid_otp(runs: list[tuple[int, int]], valid: bool) -> None:  # noqa: FBT001
+    frames = expand(runs)
+    assert is_valid_otp(frames, list(OTP)) is valid
+    status, read = run_matcher(frames)
+    assert (status == OTPMatcher.MATCHED) is valid
+    assert is_valid_otp(frames[:read], list(OTP)) is valid
+
+
+def test_matcher_never_fails_before_the_end() -> None:
+    matcher = OTPMatcher(OTP)
+    for digit in expand([(0, 5), (4, 20), (3, 20), (2, 20)]):
+        assert matcher.push(digit) == OTPMatcher.PENDING
+    assert matcher.finish() == OTPMatcher.FAILED
+
+
+def test_matcher_stops_on_the_frames_the_validator_accepts() -> None:
+    rng = random.Random(12)  # noqa: S311 - reproducible test data
+    for _ in range(500):
+        runs = [(rng.choice([0, 1, 2, 3, 4, 5]), rng.randint(1, 12)) for _ in range(rng.randint(1, 12))]
+        frames = expand(runs)
+        status, read = run_matcher(frames)
+        if status == OTPMatcher.MATCHED:
+            assert is_valid_otp(frames[:read], list(OTP))
+            assert not any(is_valid_otp(frames[:shorter], list(OTP)) for shorter in range(1, read))
+        else:
+            assert read == len(frames)
+            assert not any(is_valid_otp(frames[:prefix], list(OTP)) for prefix in range(1, len(frames) + 1))
+
+
+@pytest.mark.parametrize(("otp", "expected"), [("1234", True), ("0000", True), ("12a4", False), ("123", False), ("12345", False), (None, False)])
+def test_is_otp_code_accepts_only_four_digits(otp: object, expected: bool) -> None:  # noqa: FBT001
+    assert is_otp_code(otp) is expected
@@ -0,0 +1,30 @@
+"""Tests for the per-user reference face cache of the video deployment."""
+
+import pytest
+
+pytest.importorskip("cv2")
+
+import cv2
+import numpy as np
+
+from backend.model_server.reference_faces import ReferenceFaceCache
+
+
+def encoded_face(value: int) -> bytes:
+    return cv2.imencode(".png", np.full((20, 20), value, dtype=np.uint8))[1].tobytes()
+
+
+def test_sent_reference_faces_are_decoded_once_per_content() -> None:
+    cache = ReferenceFaceCache()
+    first = cache.get_encoded("user", memoryview(encoded_face(10)))
+    assert first is not None
+    assert first.shape == (20, 20)
+    assert cache.get_encoded("user", encoded_face(10)) is first
+    assert int(cache.get_encoded("user", encoded_face(200))[0, 0]) == 200  # re-registration sends new bytes
+    assert cache.stats() == {"hits": 1, "misses": 2, "entries": 1}
+
+
+def test_undecodable_reference_faces_are_not_cached() -> None:
+    cache = ReferenceFaceCache()
+    assert cache.get_encoded("user", b"not an image") is None
+    assert cache.stats()["entries"] == 0
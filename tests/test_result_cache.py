@@ -0,0 +1,47 @@
+"""Tests for the persistent OCR result cache shared by the ID replicas of a host."""
+
+import sqlite3
+from pathlib import Path
+
+from backend.model_server.result_cache import CachedResult, OCRResultCache
+
+RESULT = CachedResult({"name": "A"}, b"card", b"face")
+
+
+def test_lookups_do_not_write_to_the_database(tmp_path: Path) -> None:
+    cache = OCRResultCache(tmp_path / "cache.sqlite", 1024 * 1024)
+    cache.put("key", RESULT)
+    changes = cache.connection.total_changes
+    assert cache.get("key") == RESULT
+    assert cache.get("other") is None
+    assert cache.connection.total_changes == changes
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "errors": 0, "entries": 1}
+    cache.close()
+
+
+def test_hits_keep_entries_from_being_evicted(tmp_path: Path) -> None:
+    entry_size = len('{"name": "A"}') + len(RESULT.card) + len(RESULT.face)
+    cache = OCRResultCache(tmp_path / "cache.sqlite", 2 * entry_size)
+    cache.put("old", RESULT)
+    cache.put("new", RESULT)
+    assert cache.get("old") == RESULT
+    cache.put("newest", RESULT)
+    assert cache.get("old") == RESULT
+    assert cache.get("new") is None
+    cache.close()
+
+
+def test_database_errors_are_misses_and_drop_inserts(tmp_path: Path) -> None:
+    db_path = tmp_path / "cache.sqlite"
+    cache = OCRResultCache(db_path, 1024 * 1024)
+    cache.connection.execute("PRAGMA busy_timeout = 0")
+    other_replica = sqlite3.connect(str(db_path))
+    other_replica.execute("BEGIN EXCLUSIVE")  # another replica holds the write lock
+    cache.put("key", RESULT)
+    other_replica.rollback()
+    assert cache.get("key") is None
+    other_replica.execute("DROP TABLE ocr_results")
+    other_replica.close()
+    assert cache.get("key") is None
+    assert cache.stats()["errors"] == 2
+    cache.close()
@@ -0,0 +1,55 @@
+"""Tests for the run-length encoded OTP timelines returned by the video deployment."""
+
+import itertools
+import random
+
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("mediapipe")
+pytest.importorskip("ray")
+
+from backend.model_server.video_processing import encode_timeline, expand_timeline, merge_timelines
+from backend.otp_validation import is_valid_otp, is_valid_otp_timeline
+
+OTP = "1234"
+
+
+def random_frames(rng: random.Random) -> tuple[list[int], list[float]]:
+    digits = [digit for _ in range(rng.randint(1, 15)) for digit in [rng.choice([0, 1, 2, 3, 4, 5])] * rng.randint(1, 10)]
+    confidences = [rng.choice([1.0, rng.uniform(0.5, 1.0)]) for _ in digits]
+    return digits, confidences
+
+
+def test_encode_expand_round_trip() -> None:
+    digits = [0, 0, 1, 1, 1, 2, 1, 1]
+    timeline = encode_timeline(digits, [1.0] * len(digits))
+    assert timeline == [[0, 0, 2, 1.0], [1, 2, 3, 1.0], [2, 5, 1, 1.0], [1, 6, 2, 1.0]]
+    assert expand_timeline(timeline) == digits
+
+
+def test_confidence_is_the_full_precision_mean() -> None:
+    (segment,) = encode_timeline([3, 3, 3], [0.9, 0.8, 0.7001])
+    assert segment[3] == pytest.approx((0.9 + 0.8 + 0.7001) / 3, abs=1e-12)
+
+
+def test_merge_of_split_timelines_matches_whole_timeline() -> None:
+    rng = random.Random(7)  # noqa: S311 - reproducible test data
+    for _ in range(200):
+        digits, confidences = random_frames(rng)
+        cuts = sorted(rng.sample(range(1, len(digits)), min(3, len(digits) - 1))) if len(digits) > 1 else []
+        bounds = [0, *cuts, len(digits)]
+        parts = []
+        for start, stop in itertools.pairwise(bounds):
+            parts.append([[digit, first + start, length, confidence] for digit, first, length, confidence in encode_timeline(digits[start:stop], confidences[start:stop])])
+        merged, whole = merge_timelines(parts), encode_timeline(digits, confidences)
+        assert [segment[:3] for segment in merged] == [segment[:3] for segment in whole]
+        assert [segment[3] for segment in merged] == pytest.approx([segment[3] for segment in whole], abs=1e-12)
+
+
+def test_timeline_validation_matches_per_frame_validation() -> None:
+    rng = random.Random(3)  # noqa: S311 - reproducible test data
+    for _ in range(500):
+        digits, confidences = random_frames(rng)
+        timeline = encode_timeline(digits, confidences)
+        assert is_valid_otp_timeline(timeline, list(OTP)) == is_valid_otp(digits, list(OTP), confidences)